@@ -25,9 +25,11 @@ from services.torrentio import TorrentioService
 from services.debridio import DebridioService
 from services.peerflix import PeerflixService
 from services.watchhub import WatchHubService
-from utils.cache import get_cache_info
+from utils.cache import cache, get_cache_summary
 from utils.config import config
+from utils.http_client import http_clients
 from utils.logger import logger
+from utils.proxy_client import mediaflow_client, proxy_client
 
 load_dotenv()
 
@@ -55,8 +57,14 @@ streaming_services = [
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info(f"Cache Info\nSize: {(await get_cache_info())['total_size_mb']}MB")
+    cache_summary = await get_cache_summary()
+    logger.info(f"Cache Info\nSize: {cache_summary['used_memory_mb']}MB ({cache_summary['item_count']} keys)")
+    await cache.start_invalidation_listener()
     yield
+    await http_clients.aclose()
+    await proxy_client.close()
+    await mediaflow_client.close()
+    await cache.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -68,10 +76,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-USERS_FILE = "db/users.json"
 RATE_LIMIT_MINUTES = 1
 MAX_REQUESTS = 30
-CACHE_TTL = config.cache_ttl_seconds
 
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 if not ENCRYPTION_KEY:
@@ -1,6 +1,4 @@
 import base64
-import json
-import os
 import time
 from collections import defaultdict
 import copy
@@ -10,23 +8,25 @@ from urllib.parse import quote_plus
 
 import aiohttp
 from fastapi import APIRouter, Depends, HTTPException, Request, status
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
-from utils.cache import cached_decorator, cache
+from utils.buffer_allocator import buffer_allocator
+from utils.cache import cached_decorator, cache, get_cache_info, get_entry, refresh_in_background
 from utils.config import config
 from utils.logger import logger
+from utils.proxy_metrics import proxy_metrics
 from utils.service_manager import ServiceManager
+from utils.single_flight import RedisSingleFlight, SingleFlight
 from utils.streaming import StreamManager
 from utils.url_processor import URLProcessor
+from utils.user_store import user_store
 from utils.stream_formatter import StreamFormatter
 
 router = APIRouter()
 
 from main import (
-    CACHE_TTL,
     ENCRYPTION_KEY,
-    USERS_FILE,
     User,
     admin_auth,
     rate_limiter,
@@ -39,18 +39,11 @@ stream_manager = StreamManager()
 url_processor = URLProcessor(ENCRYPTION_KEY)
 url_processor.set_services(streaming_services)
 stream_formatter = StreamFormatter(url_processor)
+stream_fetches = RedisSingleFlight(cache) if config.redis_single_flight else SingleFlight()
 
 
 def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-
-def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=4)
+    return user_store.all()
 
 
 async def verify_user(user_path: str) -> tuple[str, bool]:
@@ -72,11 +65,10 @@ async def verify_user(user_path: str) -> tuple[str, bool]:
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid credentials format: {str(e)}")
 
-    users = load_users()
-    if username not in users:
+    user_data = user_store.get(username)
+    if user_data is None:
         raise HTTPException(status_code=401, detail="Invalid credentials: User not found")
 
-    user_data = users[username]
     if user_data["password"] != safe_hash:
         raise HTTPException(status_code=401, detail="Invalid credentials: Incorrect password")
     proxy_streams = user_data.get("proxy_streams", True)
@@ -153,8 +145,8 @@ async def track_media_request(username: str, meta_id: str):
 
         history_key = f"media_history:{username}"
         history = await cache.get(history_key) or []
-        history.insert(0, entry)
-        history = history[:100]
+        # Cached values are shared with the local cache tier, build a new list
+        history = [entry] + history[:99]
         await cache.set(history_key, history, ttl=30*24*60*60)
         logger.debug(f"Stored history entry for {username}: {entry}")
     except Exception as e:
@@ -192,17 +184,16 @@ async def generate_config(request: Request):
     logger.info(f"Received configuration request for username: {user.username}")
     
     try:
-        users = load_users()
-        logger.debug(f"Loaded users from file. Found {len(users)} users")
+        user_data = user_store.get(user.username)
 
-        if user.username not in users:
+        if user_data is None:
             logger.warning(f"User not found: {user.username}")
             return JSONResponse(
                 status_code=401,
                 content={"status": "error", "message": "Invalid username or password"},
             )
 
-        stored_hash = users[user.username]["password"]
+        stored_hash = user_data["password"]
         try:
             original_hash = base64.urlsafe_b64decode(stored_hash.encode()).decode()
         except Exception as e:
@@ -291,7 +282,8 @@ async def admin_page(
             else:
                 user_last_active[username] = "never"
             
-            # Format timestamps for history entries
+            # Format timestamps for history entries, on copies so the cached entries stay untouched
+            history = [dict(entry) for entry in history[:25]]  # Get last 25 entries
             for entry in history:
                 if 'timestamp' in entry:
                     try:
@@ -299,7 +291,7 @@ async def admin_page(
                         entry['timestamp'] = dt.strftime('%m/%d/%y %I:%M %p')
                     except:
                         entry['timestamp'] = 'Unknown'
-            user_histories[username] = history[:25]  # Get last 25 entries
+            user_histories[username] = history
         except Exception as e:
             logger.error(f"Error getting history for {username}: {str(e)}", exc_info=True)
             user_histories[username] = []
@@ -352,8 +344,7 @@ async def add_user(
     if len(password) > 100:
         raise HTTPException(status_code=400, detail="Password is too long (maximum 100 characters)")
 
-    users = load_users()
-    if username in users:
+    if user_store.get(username) is not None:
         raise HTTPException(status_code=409, detail="Username already exists")
 
     try:
@@ -363,21 +354,21 @@ async def add_user(
         logger.error(f"Error hashing password: {str(e)}")
         raise HTTPException(status_code=500, detail="Error creating user: Password hashing failed")
 
-    users[username] = {
-        "password": safe_hash,
-        "proxy_streams": proxy_streams,
-        "enabled_services": [],
-        "vidi_mode": vidi_mode,
-        "simple_format": simple_format,
-        "one_per_quality": one_per_quality,
-        "cached_only": cached_only
-    }
-
     try:
-        save_users(users)
+        added = user_store.add(username, {
+            "password": safe_hash,
+            "proxy_streams": proxy_streams,
+            "enabled_services": [],
+            "vidi_mode": vidi_mode,
+            "simple_format": simple_format,
+            "one_per_quality": one_per_quality,
+            "cached_only": cached_only
+        })
     except Exception as e:
         logger.error(f"Error saving users: {str(e)}")
         raise HTTPException(status_code=500, detail="Error creating user: Failed to save user data")
+    if not added:
+        raise HTTPException(status_code=409, detail="Username already exists")
 
     logger.info(f"New user added: {username} (proxy_streams: {proxy_streams})")
     return {"status": "success", "message": "User created successfully"}
@@ -392,13 +383,9 @@ async def delete_user(username: str, credentials: HTTPBasicCredentials = Depends
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    users = load_users()
-    if username not in users:
+    if not user_store.delete(username):
         raise HTTPException(status_code=404, detail="User not found")
 
-    del users[username]
-    save_users(users)
-
     logger.info(f"User deleted: {username}")
     return {"status": "success", "message": "User deleted successfully"}
 
@@ -414,20 +401,22 @@ async def toggle_proxy(
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    users = load_users()
-    if username not in users:
+    user_data = user_store.get(username)
+    if user_data is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    users[username]["proxy_streams"] = not users[username]["proxy_streams"]
-    save_users(users)
+    user_data = user_store.update(username, proxy_streams=not user_data["proxy_streams"])
+    if user_data is None:
+        # Deleted since it was read above
+        raise HTTPException(status_code=404, detail="User not found")
 
     logger.info(
-        f"Toggled proxy for user: {username} (now: {users[username]['proxy_streams']})"
+        f"Toggled proxy for user: {username} (now: {user_data['proxy_streams']})"
     )
     return {
         "status": "success",
         "message": "Proxy toggled successfully",
-        "proxy_streams": users[username]["proxy_streams"],
+        "proxy_streams": user_data["proxy_streams"],
     }
 
 
@@ -442,20 +431,22 @@ async def toggle_vidi_mode(
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    users = load_users()
-    if username not in users:
+    user_data = user_store.get(username)
+    if user_data is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    users[username]["vidi_mode"] = not users[username].get("vidi_mode", False)
-    save_users(users)
+    user_data = user_store.update(username, vidi_mode=not user_data.get("vidi_mode", False))
+    if user_data is None:
+        # Deleted since it was read above
+        raise HTTPException(status_code=404, detail="User not found")
 
     logger.info(
-        f"Toggled vidi mode for user: {username} (now: {users[username]['vidi_mode']})"
+        f"Toggled vidi mode for user: {username} (now: {user_data['vidi_mode']})"
     )
     return {
         "status": "success",
         "message": "Vidi mode toggled successfully",
-        "vidi_mode": users[username]["vidi_mode"],
+        "vidi_mode": user_data["vidi_mode"],
     }
 
 
@@ -470,20 +461,22 @@ async def toggle_simple_format(
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    users = load_users()
-    if username not in users:
+    user_data = user_store.get(username)
+    if user_data is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    users[username]["simple_format"] = not users[username].get("simple_format", False)
-    save_users(users)
+    user_data = user_store.update(username, simple_format=not user_data.get("simple_format", False))
+    if user_data is None:
+        # Deleted since it was read above
+        raise HTTPException(status_code=404, detail="User not found")
 
     logger.info(
-        f"Toggled simple format for user: {username} (now: {users[username]['simple_format']})"
+        f"Toggled simple format for user: {username} (now: {user_data['simple_format']})"
     )
     return {
         "status": "success",
         "message": "Simple format toggled successfully",
-        "simple_format": users[username]["simple_format"],
+        "simple_format": user_data["simple_format"],
     }
 
 
@@ -498,20 +491,22 @@ async def toggle_one_per_quality(
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    users = load_users()
-    if username not in users:
+    user_data = user_store.get(username)
+    if user_data is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    users[username]["one_per_quality"] = not users[username].get("one_per_quality", False)
-    save_users(users)
+    user_data = user_store.update(username, one_per_quality=not user_data.get("one_per_quality", False))
+    if user_data is None:
+        # Deleted since it was read above
+        raise HTTPException(status_code=404, detail="User not found")
 
     logger.info(
-        f"Toggled one per quality for user: {username} (now: {users[username]['one_per_quality']})"
+        f"Toggled one per quality for user: {username} (now: {user_data['one_per_quality']})"
     )
     return {
         "status": "success",
         "message": "One per quality toggled successfully",
-        "one_per_quality": users[username]["one_per_quality"],
+        "one_per_quality": user_data["one_per_quality"],
     }
 
 
@@ -526,20 +521,22 @@ async def toggle_cached_only(
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    users = load_users()
-    if username not in users:
+    user_data = user_store.get(username)
+    if user_data is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    users[username]["cached_only"] = not users[username].get("cached_only", False)
-    save_users(users)
+    user_data = user_store.update(username, cached_only=not user_data.get("cached_only", False))
+    if user_data is None:
+        # Deleted since it was read above
+        raise HTTPException(status_code=404, detail="User not found")
 
     logger.info(
-        f"Toggled cached only for user: {username} (now: {users[username]['cached_only']})"
+        f"Toggled cached only for user: {username} (now: {user_data['cached_only']})"
     )
     return {
         "status": "success",
         "message": "Cached only toggled successfully",
-        "cached_only": users[username]["cached_only"],
+        "cached_only": user_data["cached_only"],
     }
 
 
@@ -554,6 +551,58 @@ async def get_available_services(credentials: HTTPBasicCredentials = Depends(HTT
     return {"services": [service.name for service in streaming_services]}
 
 
+@router.get("/admin/service_health")
+async def get_service_health(credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
+    if not admin_auth.verify_admin(credentials.username, credentials.password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return {"services": service_manager.get_service_health()}
+
+
+@router.get("/admin/cache_stats")
+async def get_cache_stats(credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
+    if not admin_auth.verify_admin(credentials.username, credentials.password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return await get_cache_info()
+
+
+@router.get("/admin/proxy_sessions")
+async def get_proxy_sessions(credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
+    if not admin_auth.verify_admin(credentials.username, credentials.password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    sessions = proxy_metrics.snapshot()
+    return {
+        "active_sessions": len(sessions),
+        "buffered_mb": round(buffer_allocator.buffered_bytes / 1024 / 1024, 1),
+        "sessions": sessions,
+    }
+
+
+@router.get("/admin/metrics", response_class=PlainTextResponse)
+async def get_metrics(credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
+    if not admin_auth.verify_admin(credentials.username, credentials.password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return PlainTextResponse(
+        proxy_metrics.render_prometheus(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 @router.get("/admin/user_services/{username}")
 async def get_user_services(username: str, credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
     if not admin_auth.verify_admin(credentials.username, credentials.password):
@@ -562,10 +611,10 @@ async def get_user_services(username: str, credentials: HTTPBasicCredentials = D
             detail="Invalid credentials",
             headers={"WWW-Authenticate": "Basic"},
         )
-    users = load_users()
-    if username not in users:
+    user_data = user_store.get(username)
+    if user_data is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"enabled_services": users[username].get("enabled_services", [])}
+    return {"enabled_services": user_data.get("enabled_services", [])}
 
 
 @router.post("/admin/update_services/{username}")
@@ -576,8 +625,7 @@ async def update_user_services(username: str, request: Request, credentials: HTT
             detail="Invalid credentials",
             headers={"WWW-Authenticate": "Basic"},
         )
-    users = load_users()
-    if username not in users:
+    if user_store.get(username) is None:
         raise HTTPException(status_code=404, detail="User not found")
     
     form_data = await request.form()
@@ -592,8 +640,8 @@ async def update_user_services(username: str, request: Request, credentials: HTT
     if set(services) == set(available_services):
         services = []
     
-    users[username]["enabled_services"] = services
-    save_users(users)
+    if user_store.update(username, enabled_services=services) is None:
+        raise HTTPException(status_code=404, detail="User not found")
     return {"status": "success", "message": "Services updated successfully"}
 
 
@@ -604,9 +652,7 @@ async def stream(user_path: str, meta_id: str):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
 
     try:
-        users = load_users()
-        user_data = users[username]
-        enabled_services = user_data.get("enabled_services", [])
+        user_data = user_store.get(username)
         
         # Track media request
         await track_media_request(username, meta_id)
@@ -614,18 +660,36 @@ async def stream(user_path: str, meta_id: str):
         # Generate cache key for raw streams
         cache_key = f"raw_streams:{meta_id}"
         
+        def fetch_streams():
+            return service_manager.fetch_all_streams(meta_id, username, cache_results=True)
+
+        async def get_cached_streams(allow_stale: bool = True):
+            cached_data, stale = await get_entry(cache_key)
+            if not cached_data or (stale and not allow_stale):
+                return None
+            return cached_data["streams"]
+
         # Try to get raw streams from cache
-        cached_data = await cache.get(cache_key)
+        cached_data, stale = await get_entry(cache_key)
         
         if cached_data:
             raw_streams = cached_data["streams"]
-            logger.info(f"Cache hit for {meta_id} ({username})")
+            if stale:
+                # Serve the stale streams now, refresh them for the next request
+                refresh_in_background(
+                    cache_key,
+                    fetch_streams,
+                    flight=stream_fetches,
+                    check=lambda: get_cached_streams(allow_stale=False),
+                )
+            logger.info(f"Cache hit for {meta_id} ({username}){' (stale)' if stale else ''}")
         else:
-            # Fetch and cache raw streams
-            raw_streams = await service_manager.fetch_all_streams(meta_id, username)
+            # Fetch and cache raw streams, concurrent misses share one upstream fetch
+            raw_streams = await stream_fetches.do(
+                cache_key, fetch_streams, check=get_cached_streams
+            )
             if not raw_streams:
                 raise HTTPException(status_code=404, detail="No streams found")
-            await cache.set(cache_key, {"streams": raw_streams}, ttl=CACHE_TTL)
             logger.info(f"Cache miss for {meta_id} ({username})")
 
         # Process streams with user-specific settings
@@ -633,22 +697,16 @@ async def stream(user_path: str, meta_id: str):
         password_part = f"password={user_data['password']}"
         user_path = f"{username_part}|{password_part}"
         
-        # Process streams with URL generation and formatting
+        # Process streams with URL generation, service filtering and formatting
         processed_streams = await stream_formatter.process_streams(
             raw_streams,
             user_path,
             proxy_streams,
             meta_id,
-            username
-        )
-        
-        # Filter streams based on user's enabled services
-        filtered_streams = stream_formatter.filter_streams_by_services(
-            processed_streams,
-            enabled_services
+            user_data
         )
 
-        return {"streams": filtered_streams}
+        return {"streams": processed_streams}
     except Exception as e:
         logger.error(f"Error in stream endpoint: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -668,12 +726,14 @@ async def proxy_stream(user_path: str, encrypted_url: str, request: Request):
             f"Proxy stream starting for user: {username} (proxy_streams: {proxy_streams})"
         )
 
-        original_url = url_processor.decrypt_url(encrypted_url)
+        original_url = url_processor.decrypt_url(encrypted_url, user_path)
 
         return await stream_manager.create_streaming_response(
-            original_url, request.headers
+            original_url, request.headers, username
         )
 
+    except HTTPException:
+        raise
     except aiohttp.ClientError as e:
         logger.error(f"Request failed: {str(e)}")
         raise HTTPException(
@@ -684,6 +744,31 @@ async def proxy_stream(user_path: str, encrypted_url: str, request: Request):
         raise HTTPException(status_code=502, detail="Internal proxy error")
 
 
+@router.head("/{user_path}/proxy/{encrypted_url:path}")
+async def proxy_stream_head(user_path: str, encrypted_url: str, request: Request):
+    username, proxy_streams = await verify_user(user_path)
+    if rate_limiter.is_rate_limited(username):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+    try:
+        original_url = url_processor.decrypt_url(encrypted_url, user_path)
+
+        return await stream_manager.create_head_response(
+            original_url, request.headers
+        )
+
+    except HTTPException:
+        raise
+    except aiohttp.ClientError as e:
+        logger.error(f"HEAD request failed: {str(e)}")
+        raise HTTPException(
+            status_code=502, detail=f"Failed to fetch content: {str(e)}"
+        )
+    except Exception as e:
+        logger.error(f"Unexpected proxy error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=502, detail="Internal proxy error")
+
+
 @router.get("/{user_path}/manifest.json")
 async def user_manifest(user_path: str):
     username, proxy_streams = await verify_user(user_path)
@@ -692,8 +777,7 @@ async def user_manifest(user_path: str):
     global_services = [service.name for service in streaming_services]
     global_services_str = ", ".join(global_services)
 
-    users = load_users()
-    user_data = users[username]
+    user_data = user_store.get(username)
     enabled_services = user_data.get("enabled_services", [])
     simple_format = user_data.get("simple_format", False)
     mediaflow_enabled = config.mediaflow_enabled
@@ -1046,11 +1130,10 @@ async def get_user_settings(user_path: str):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
 
     try:
-        users = load_users()
-        if username not in users:
+        user_data = user_store.get(username)
+        if user_data is None:
             raise HTTPException(status_code=404, detail="User not found")
         
-        user_data = users[username]
         return {
             "vidi_mode": user_data.get("vidi_mode", False),
             "simple_format": user_data.get("simple_format", False),
@@ -1068,21 +1151,20 @@ async def update_user_settings(user_path: str, request: Request):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
 
     try:
-        users = load_users()
-        if username not in users:
+        if user_store.get(username) is None:
             raise HTTPException(status_code=404, detail="User not found")
         
         data = await request.json()
-        user_data = users[username]
         
         # Only allow updating specific settings
         allowed_settings = ["vidi_mode", "simple_format", "one_per_quality", "cached_only"]
-        for setting in allowed_settings:
-            if setting in data:
-                user_data[setting] = bool(data[setting])
+        changes = {setting: bool(data[setting]) for setting in allowed_settings if setting in data}
         
-        save_users(users)
+        if user_store.update(username, **changes) is None:
+            raise HTTPException(status_code=404, detail="User not found")
         return {"status": "success", "message": "Settings updated successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating user settings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -6,6 +6,7 @@ import httpx
 from fastapi import HTTPException
 
 from utils.config import config
+from utils.http_client import http_clients
 from utils.logger import logger
 
 from .base import StreamingService
@@ -32,22 +33,23 @@ class CometService(StreamingService):
             "debridStreamProxyPassword": ""
         }}"""
         self.options_encoded = base64.b64encode(self.options.encode()).decode("utf-8")
+        http_clients.register(self.name)
 
     @property
     def name(self) -> str:
         return "Comet"
 
     async def _fetch_from_comet(self, url: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(url)
-                response.raise_for_status()
-                data = response.json()
-                logger.debug(f"Comet response: {data}")
-                return data
-            except httpx.HTTPError as e:
-                logger.error(f"Comet request failed: {str(e)}")
-                raise HTTPException(status_code=502, detail="Upstream service error")
+        client = http_clients.get(self.name)
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            data = response.json()
+            logger.debug(f"Comet response: {data}")
+            return data
+        except httpx.HTTPError as e:
+            logger.error(f"Comet request failed: {str(e)}")
+            raise HTTPException(status_code=502, detail="Upstream service error")
 
     async def get_streams(self, meta_id: str) -> List[Dict]:
         url = f"{self.base_url}/{self.options_encoded}/stream/{meta_id}"
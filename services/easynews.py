@@ -4,6 +4,7 @@ from typing import Dict, List
 import httpx
 from fastapi import HTTPException
 
+from utils.http_client import http_clients
 from utils.logger import logger
 
 from .base import StreamingService
@@ -15,22 +16,23 @@ class EasynewsService(StreamingService):
         self.username = os.getenv("EASYNEWS_USERNAME")
         self.password = os.getenv("EASYNEWS_PASSWORD")
         self.options = f"%7B%22username%22%3A%22{self.username}%22%2C%22password%22%3A%22{self.password}%22%7D"
+        http_clients.register(self.name)
 
     @property
     def name(self) -> str:
         return "Easynews"
 
     async def _fetch_from_easynews(self, url: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(url)
-                response.raise_for_status()
-                data = response.json()
-                logger.debug(f"Easynews response: {data}")
-                return data
-            except httpx.HTTPError as e:
-                logger.error(f"Easynews request failed: {str(e)}")
-                raise HTTPException(status_code=502, detail="Upstream service error")
+        client = http_clients.get(self.name)
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            data = response.json()
+            logger.debug(f"Easynews response: {data}")
+            return data
+        except httpx.HTTPError as e:
+            logger.error(f"Easynews request failed: {str(e)}")
+            raise HTTPException(status_code=502, detail="Upstream service error")
 
     async def get_streams(self, meta_id: str) -> List[Dict]:
         url = f"{self.base_url}/{self.options}/stream/{meta_id}"
@@ -0,0 +1,10 @@
+import os
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(ROOT, "data", "config.json")
+
+# utils.config loads data/config.json on import, use the example config when there is none
+if not os.path.exists(CONFIG_PATH):
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
+    shutil.copy(os.path.join(ROOT, "config.json.example"), CONFIG_PATH)
@@ -0,0 +1,45 @@
+import pytest
+
+from utils.bandwidth import BandwidthScheduler
+
+
+def rates(scheduler):
+    return [session.bucket.rate for session in scheduler._sessions]
+
+
+def test_floor_never_exceeds_caps():
+    scheduler = BandwidthScheduler(0, 0, 10, 5)
+    scheduler.open_session("alice")
+    assert rates(scheduler) == [10]
+
+
+def test_floor_is_taken_from_faster_streams_within_total():
+    scheduler = BandwidthScheduler(100, 0, 0, 20)
+    for username in ("alice", "alice", "alice", "bob"):
+        assert scheduler.open_session(username) is not None
+
+    assert sum(rates(scheduler)) == pytest.approx(100)
+    assert min(rates(scheduler)) == pytest.approx(20)
+    assert rates(scheduler)[-1] == pytest.approx(40)
+
+
+def test_refuses_sessions_that_cant_get_the_floor():
+    scheduler = BandwidthScheduler(100, 50, 0, 25)
+    assert scheduler.open_session("alice") is not None
+    assert scheduler.open_session("alice") is not None
+    # alice's 50 can't give a third stream 25
+    assert scheduler.open_session("alice") is None
+
+    assert scheduler.open_session("bob") is not None
+    assert scheduler.open_session("bob") is not None
+    assert scheduler.open_session("carol") is None
+
+    scheduler.close_session(scheduler._sessions[0])
+    assert scheduler.open_session("carol") is not None
+    assert sum(rates(scheduler)) <= 100
+
+
+@pytest.mark.parametrize("limits", [(10, 0, 0), (0, 10, 0), (0, 0, 10)])
+def test_floor_above_a_limit_is_a_config_error(limits):
+    with pytest.raises(ValueError):
+        BandwidthScheduler(*limits, 20)
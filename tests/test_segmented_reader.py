@@ -0,0 +1,66 @@
+import asyncio
+
+from utils.buffer_allocator import buffer_allocator
+from utils.segmented_reader import SegmentedReader
+
+MB = 1024 * 1024
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+class FakeContent:
+    async def readexactly(self, size):
+        return b"x" * size
+
+
+class FakeResponse:
+    content = FakeContent()
+
+    def release(self):
+        pass
+
+
+def segmented_reader(max_connections):
+    return SegmentedReader(
+        None,
+        "https://cdn.example.com/file",
+        {},
+        FakeResponse(),
+        0,
+        100 * MB - 1,
+        4 * MB,
+        max_connections,
+        3,
+    )
+
+
+def test_reserves_memory_for_extra_connections():
+    async def scenario():
+        reader = segmented_reader(4)
+        assert reader.max_connections == 4
+        assert buffer_allocator.reserved_bytes == 3 * 4 * MB
+
+        await reader.close()
+        reader.release_memory()
+        assert buffer_allocator.reserved_bytes == 0
+
+    run(scenario())
+
+
+def test_connections_limited_to_granted_memory():
+    async def scenario():
+        # Leave room for two more segments and a bit
+        held = buffer_allocator.reserve(buffer_allocator.buffer_budget_bytes - 9 * MB)
+        try:
+            reader = segmented_reader(8)
+            assert reader.max_connections == 3
+            assert buffer_allocator.reserved_bytes == held + 2 * 4 * MB
+            await reader.close()
+            reader.release_memory()
+        finally:
+            buffer_allocator.unreserve(held)
+        assert buffer_allocator.reserved_bytes == 0
+
+    run(scenario())
@@ -0,0 +1,34 @@
+import pytest
+
+from utils.serializers import CompactSerializer
+
+EPISODES = {1: {1: "Pilot", 2: "Second"}, 2: {1: "Premiere"}}
+STREAMS = {"streams": [{"name": "Torrentio", "url": "https://example.com/x.mkv", "size": 123}]}
+
+
+@pytest.mark.parametrize("codec", ["msgpack", "json", "pickle"])
+@pytest.mark.parametrize("compression", ["zstd", "zlib", "none"])
+def test_round_trip(codec, compression):
+    serializer = CompactSerializer(codec=codec, compression=compression, compression_threshold=16)
+    for value in (STREAMS, EPISODES, [STREAMS, EPISODES], "text", None):
+        assert serializer.loads(serializer.dumps(value)) == value
+
+
+def test_json_falls_back_to_pickle_for_non_str_keys():
+    serializer = CompactSerializer(codec="json", compression="none")
+    assert serializer.dumps(STREAMS)[2:3] == CompactSerializer.CODEC_JSON
+
+    data = serializer.dumps({"seasons": [EPISODES]})
+    assert data[2:3] == CompactSerializer.CODEC_PICKLE
+    assert serializer.loads(data) == {"seasons": [EPISODES]}
+
+
+@pytest.mark.parametrize("compression", ["zstd", "zlib", "none"])
+def test_sizes_are_uncompressed(compression):
+    serializer = CompactSerializer(codec="json", compression=compression, compression_threshold=16)
+    value = {"streams": [STREAMS["streams"][0]] * 50}
+    uncompressed = len(CompactSerializer(codec="json", compression="none").dumps(value)) - 4
+
+    data, size = serializer.dumps_sized(value)
+    assert size == uncompressed
+    assert serializer.loads_sized(data) == (value, uncompressed)
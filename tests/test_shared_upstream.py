@@ -0,0 +1,113 @@
+import asyncio
+
+import aiohttp
+
+from utils.buffer_allocator import buffer_allocator
+from utils.shared_upstream import SharedUpstream
+from utils.streaming import StreamManager
+
+MB = 1024 * 1024
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+class FakeContent:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def read(self, _size):
+        chunk = self.chunks.pop(0)
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+
+class FakeResponse:
+    def __init__(self, status, headers, chunks=()):
+        self.status = status
+        self.headers = headers
+        self.content = FakeContent(chunks)
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+def test_empty_range_releases_upstream():
+    async def scenario():
+        manager = StreamManager()
+        response = FakeResponse(200, {"Content-Length": "0"})
+        buffer = buffer_allocator.acquire(8 * MB)
+
+        upstream = manager._share_upstream("https://cdn.example.com/empty", {}, response)
+        assert buffer_allocator.reserved_bytes > 0
+
+        subscriber = await upstream.subscribe(upstream.start, upstream.end, buffer)
+        assert subscriber.done
+        assert await buffer.get() is None
+        await upstream.unsubscribe(subscriber)
+
+        assert upstream.finished
+        assert response.released
+        assert buffer_allocator.reserved_bytes == 0
+        assert manager._shared_upstreams == {}
+
+    run(scenario())
+
+
+def shared_upstream(response, resume, max_retries):
+    return SharedUpstream(
+        "https://cdn.example.com/file", response, 0, None, None, MB, 0, resume, max_retries
+    )
+
+
+def test_resumes_that_fail_immediately_are_capped():
+    async def scenario():
+        attempts = []
+
+        async def resume(offset, end, attempt):
+            attempts.append(attempt)
+            # Accepted with 206 but the connection drops before any data
+            return FakeResponse(206, {}, [aiohttp.ClientPayloadError("dropped")])
+
+        response = FakeResponse(200, {}, [b"x" * 10, aiohttp.ClientPayloadError("dropped")])
+        upstream = shared_upstream(response, resume, 3)
+        buffer = buffer_allocator.acquire(8 * MB)
+        await upstream.subscribe(0, None, buffer)
+
+        assert await buffer.get() == b"x" * 10
+        assert await buffer.get() is None
+        assert attempts == [1, 2, 3]
+        assert not upstream.completed
+        buffer_allocator.release(buffer)
+
+    run(scenario())
+
+
+def test_progress_resets_retries():
+    async def scenario():
+        attempts = []
+
+        async def resume(offset, end, attempt):
+            attempts.append(attempt)
+            if len(attempts) < 5:
+                return FakeResponse(206, {}, [b"y", aiohttp.ClientPayloadError("dropped")])
+            return FakeResponse(206, {}, [b"z", b""])
+
+        response = FakeResponse(200, {}, [aiohttp.ClientPayloadError("dropped")])
+        upstream = shared_upstream(response, resume, 2)
+        buffer = buffer_allocator.acquire(8 * MB)
+        await upstream.subscribe(0, None, buffer)
+
+        received = b""
+        while (chunk := await buffer.get()) is not None:
+            received += chunk
+
+        assert received == b"yyyyz"
+        assert attempts == [1, 1, 1, 1, 1]
+        assert upstream.completed
+        buffer_allocator.release(buffer)
+
+    run(scenario())
@@ -0,0 +1,67 @@
+import asyncio
+
+from utils.stream_buffer import StreamBuffer
+
+MB = 1024 * 1024
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+def test_put_waits_for_low_watermark():
+    async def scenario():
+        buffer = StreamBuffer(8 * MB)
+        await buffer.put(b"x" * 6 * MB)
+        producer = asyncio.create_task(buffer.put(b"y" * 4 * MB))
+        await asyncio.sleep(0)
+        assert not producer.done()
+
+        assert len(await buffer.get()) == 6 * MB
+        assert await producer
+        assert len(await buffer.get()) == 4 * MB
+
+    run(scenario())
+
+
+def test_producer_wakes_after_buffer_grows():
+    async def scenario():
+        buffer = StreamBuffer(8 * MB)
+        for _ in range(6):
+            await buffer.put(b"x" * MB)
+        producer = asyncio.create_task(buffer.put(b"y" * 4 * MB))
+        await asyncio.sleep(0)
+        assert not producer.done()
+
+        # Raises low_watermark above the buffered size, so draining never crosses it
+        buffer.resize(256 * MB)
+        for _ in range(6):
+            assert len(await buffer.get()) == MB
+        assert await producer
+        assert len(await buffer.get()) == 4 * MB
+
+    run(scenario())
+
+
+def test_close_releases_blocked_producer():
+    async def scenario():
+        buffer = StreamBuffer(MB)
+        await buffer.put(b"x" * MB)
+        producer = asyncio.create_task(buffer.put(b"y" * MB))
+        await asyncio.sleep(0)
+        await buffer.close()
+        assert await producer is False
+        assert await buffer.get() is None
+
+    run(scenario())
+
+
+def test_get_returns_none_after_finish():
+    async def scenario():
+        buffer = StreamBuffer(MB)
+        await buffer.put(b"abc")
+        await buffer.finish()
+        assert await buffer.get() == b"abc"
+        assert await buffer.get() is None
+
+    run(scenario())
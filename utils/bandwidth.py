@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import Counter
+from typing import List, Optional
+
+from utils.config import config
+
+MBPS = 1000 * 1000 / 8
+
+
+class TokenBucket:
+    """Token bucket that may go into debt, callers sleep until the debt is paid off."""
+
+    def __init__(self, rate: float, burst_seconds: float = 1.0):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.tokens = rate * burst_seconds
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate: float) -> None:
+        self._refill()
+        self.rate = rate
+
+    def reserve(self, size: int) -> float:
+        """Take size tokens, returns how many seconds to wait before sending them."""
+        self._refill()
+        self.tokens -= size
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate * self.burst_seconds, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class BandwidthSession:
+    def __init__(self, username: Optional[str]):
+        self.username = username
+        self.bucket: Optional[TokenBucket] = None
+
+
+class BandwidthScheduler:
+    """Fair sharing of the proxy's upload bandwidth between users and their streams.
+
+    The total limit is split equally between active users, and each user's share
+    equally between their streams. Per-user and per-stream caps apply on top.
+    Every stream gets at least min_session_rate so viewers keep enough for
+    playback, new streams are refused when that can't be given within the total
+    and user limits. Rates are recomputed whenever a stream starts or ends.
+    """
+
+    def __init__(
+        self,
+        total_rate: float,
+        user_rate: float,
+        session_rate: float,
+        min_session_rate: float,
+    ):
+        for name, rate in (
+            ("proxy_bandwidth_limit_mbps", total_rate),
+            ("proxy_user_limit_mbps", user_rate),
+            ("proxy_session_limit_mbps", session_rate),
+        ):
+            if rate and min_session_rate > rate:
+                raise ValueError(f"proxy_min_session_mbps can't be higher than {name}")
+
+        self.total_rate = total_rate
+        self.user_rate = user_rate
+        self.session_rate = session_rate
+        self.min_session_rate = min_session_rate
+        self._sessions: List[BandwidthSession] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.total_rate or self.user_rate or self.session_rate)
+
+    def open_session(self, username: Optional[str]) -> Optional[BandwidthSession]:
+        """Start pacing a stream, returns None when it can't get min_session_rate."""
+        session = BandwidthSession(username)
+        if not self.enabled:
+            return session
+
+        floor = self.min_session_rate
+        user_sessions = sum(1 for other in self._sessions if other.username == username)
+        if (self.total_rate and (len(self._sessions) + 1) * floor > self.total_rate) or (
+            self.user_rate and (user_sessions + 1) * floor > self.user_rate
+        ):
+            return None
+
+        self._sessions.append(session)
+        self._rebalance()
+        return session
+
+    def close_session(self, session: BandwidthSession) -> None:
+        if session in self._sessions:
+            self._sessions.remove(session)
+            self._rebalance()
+
+    async def throttle(self, session: BandwidthSession, size: int) -> None:
+        """Wait until the session may send size more bytes."""
+        if session.bucket is None:
+            return
+        delay = session.bucket.reserve(size)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _rebalance(self) -> None:
+        floor = self.min_session_rate
+        sessions_per_user = Counter(session.username for session in self._sessions)
+        rates = []
+        for session in self._sessions:
+            user_sessions = sessions_per_user[session.username]
+            caps = []
+            if self.user_rate:
+                caps.append(self.user_rate / user_sessions)
+            if self.session_rate:
+                caps.append(self.session_rate)
+            if self.total_rate:
+                share = self.total_rate / len(sessions_per_user) / user_sessions
+            else:
+                share = min(caps)
+            rates.append(min([max(share, floor)] + caps))
+
+        if self.total_rate:
+            # Streams raised to the floor take it from the streams above the floor
+            excess = sum(rates) - self.total_rate
+            spare = sum(rate - floor for rate in rates)
+            if excess > 0 and spare > 0:
+                rates = [rate - (rate - floor) * excess / spare for rate in rates]
+
+        for session, rate in zip(self._sessions, rates):
+            if session.bucket is None:
+                session.bucket = TokenBucket(rate)
+            else:
+                session.bucket.set_rate(rate)
+
+
+bandwidth_scheduler = BandwidthScheduler(
+    config.proxy_bandwidth_limit_mbps * MBPS,
+    config.proxy_user_limit_mbps * MBPS,
+    config.proxy_session_limit_mbps * MBPS,
+    config.proxy_min_session_mbps * MBPS,
+)
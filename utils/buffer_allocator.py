@@ -0,0 +1,84 @@
+from typing import Dict, Optional
+
+from utils.config import config
+from utils.logger import logger
+from utils.stream_buffer import StreamBuffer
+
+
+class BufferAllocator:
+    """Process-wide memory budget for proxy stream buffers.
+
+    Every proxied session gets its buffer from here. The budget is shared equally:
+    each buffer may hold at most budget / sessions bytes (capped at the requested
+    size), so read-ahead shrinks as more viewers join and grows again when they
+    leave. New sessions are refused once they could not get min_buffer_bytes.
+    Memory held outside the buffers, like shared upstream history, is reserved
+    from the budget first.
+    """
+
+    def __init__(self, budget_bytes: int, min_buffer_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.min_buffer_bytes = min_buffer_bytes
+        self.reserved_bytes = 0
+        self._buffers: Dict[StreamBuffer, int] = {}
+
+    @property
+    def buffer_budget_bytes(self) -> int:
+        return self.budget_bytes - self.reserved_bytes
+
+    def acquire(self, requested_bytes: int) -> Optional[StreamBuffer]:
+        """Create a buffer for a new session, returns None when the budget is exhausted."""
+        sessions = len(self._buffers) + 1
+        if self.buffer_budget_bytes // sessions < min(self.min_buffer_bytes, requested_bytes):
+            logger.warning(
+                f"Proxy buffer budget exhausted ({len(self._buffers)} sessions, "
+                f"{self.buffered_bytes / 1024 / 1024:.0f} MB buffered)"
+            )
+            return None
+
+        buffer = StreamBuffer(requested_bytes)
+        self._buffers[buffer] = requested_bytes
+        self._rebalance()
+        return buffer
+
+    def release(self, buffer: StreamBuffer) -> None:
+        if self._buffers.pop(buffer, None) is not None:
+            self._rebalance()
+
+    def reserve(self, requested_bytes: int) -> int:
+        """Set aside up to requested_bytes, returns how many were granted.
+
+        Never takes memory the current sessions need for min_buffer_bytes each.
+        """
+        available = self.buffer_budget_bytes - len(self._buffers) * self.min_buffer_bytes
+        granted = max(0, min(requested_bytes, available))
+        if granted:
+            self.reserved_bytes += granted
+            self._rebalance()
+        return granted
+
+    def unreserve(self, granted_bytes: int) -> None:
+        if granted_bytes:
+            self.reserved_bytes -= granted_bytes
+            self._rebalance()
+
+    def _rebalance(self) -> None:
+        if not self._buffers:
+            return
+        share = self.buffer_budget_bytes // len(self._buffers)
+        for buffer, requested_bytes in self._buffers.items():
+            buffer.resize(min(requested_bytes, share))
+
+    @property
+    def sessions(self) -> int:
+        return len(self._buffers)
+
+    @property
+    def buffered_bytes(self) -> int:
+        return sum(buffer.size for buffer in self._buffers)
+
+
+buffer_allocator = BufferAllocator(
+    config.proxy_memory_budget_mb * 1024 * 1024,
+    config.proxy_min_buffer_mb * 1024 * 1024,
+)
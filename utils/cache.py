@@ -1,14 +1,22 @@
+import asyncio
 import functools
 import hashlib
 import inspect
 import os
 import pickle
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
 from aiocache import Cache
-from aiocache.serializers import PickleSerializer
 
 from utils.logger import logger
 from utils.config import config
+from utils.cache_stats import cache_stats, key_namespace
+from utils.serializers import CompactSerializer
+from utils.single_flight import SingleFlight
 
 
 def default_key_builder(func, *args, **kwargs):
@@ -32,15 +40,218 @@ def default_key_builder(func, *args, **kwargs):
     return key
 
 
-cache = Cache.REDIS(
-    namespace="main",
-    endpoint=os.getenv("REDIS_HOST", "debridproxy_redis"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    password=os.getenv("REDIS_PASSWORD"),
-    serializer=PickleSerializer(),
+class LocalCache:
+    """In-process LRU of deserialized values, bounded by their uncompressed serialized size in bytes."""
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, _, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[int] = None) -> None:
+        self.delete(key)
+        if value is None or size > self.max_bytes:
+            return
+        ttl = min(ttl, self.ttl) if ttl else self.ttl
+        self._entries[key] = (value, size, time.monotonic() + ttl)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TieredCache:
+    """Local LRU in front of the Redis cache.
+
+    Writes go to Redis and publish an invalidation message so the local copies in
+    other workers are dropped. Values returned from the local tier are shared
+    objects and must not be mutated by callers.
+    """
+
+    def __init__(self, redis_cache, max_bytes: int, local_ttl: int):
+        self.redis = redis_cache
+        self.local = LocalCache(max_bytes, local_ttl)
+        self.enabled = max_bytes > 0
+        self.channel = f"{redis_cache.namespace}:invalidate"
+        self.instance_id = uuid.uuid4().hex
+        self._listener_task = None
+
+    def __getattr__(self, name):
+        # raw, build_key, serializer, client etc. go straight to the Redis cache
+        return getattr(self.redis, name)
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        if self.enabled:
+            value = self.local.get(key)
+            if value is not None:
+                cache_stats.record_read(key, "local_hits")
+                return value
+
+        data = await self.redis.raw("get", self.redis.build_key(key))
+        if data is None:
+            cache_stats.record_read(key, "misses")
+            return default
+        cache_stats.record_read(key, "redis_hits")
+        value, size = self.redis.serializer.loads_sized(data)
+        if self.enabled:
+            self.local.set(key, value, size)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        data, size = self.redis.serializer.dumps_sized(value)
+        async with self.redis.client.pipeline(transaction=False) as pipe:
+            pipe.set(self.redis.build_key(key), data, ex=int(ttl) if ttl else None)
+            if self.enabled:
+                pipe.publish(self.channel, f"{self.instance_id}|{key}")
+            await pipe.execute()
+        cache_stats.record_write(key, len(data))
+        if self.enabled:
+            self.local.set(key, value, size, ttl)
+        return True
+
+    async def delete(self, key: str) -> int:
+        self.local.delete(key)
+        result = await self.redis.delete(key)
+        if self.enabled:
+            await self.redis.raw("publish", self.channel, f"{self.instance_id}|{key}")
+        return result
+
+    async def start_invalidation_listener(self) -> None:
+        if self.enabled and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen_for_invalidations())
+
+    async def close(self) -> None:
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        await self.redis.close()
+
+    async def _listen_for_invalidations(self) -> None:
+        while True:
+            pubsub = self.redis.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Messages may have been missed while we were not subscribed
+                self.local.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    sender, _, key = data.partition("|")
+                    if sender != self.instance_id:
+                        self.local.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener error: {str(e)}")
+                self.local.clear()
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+
+cache = TieredCache(
+    Cache.REDIS(
+        namespace="main",
+        endpoint=os.getenv("REDIS_HOST", "debridproxy_redis"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        password=os.getenv("REDIS_PASSWORD"),
+        serializer=CompactSerializer(
+            codec=config.cache_serializer,
+            compression=config.cache_compression,
+            compression_threshold=config.cache_compression_threshold_bytes,
+        ),
+    ),
+    max_bytes=config.local_cache_size_mb * 1024 * 1024,
+    local_ttl=config.local_cache_ttl_seconds,
 )
 
 
+SWR_MARKER = "__swr__"
+
+_refreshes = SingleFlight()
+_background_tasks = set()
+
+
+def jittered_ttl(ttl: int) -> int:
+    """Spread a TTL by +/- cache_ttl_jitter so entries written together do not expire together."""
+    jitter = config.cache_ttl_jitter
+    return max(1, int(ttl * random.uniform(1 - jitter, 1 + jitter)))
+
+
+async def set_entry(key: str, value: Any, ttl: int = config.cache_ttl_seconds) -> None:
+    """Store a value with a soft TTL (jittered ttl) and a hard TTL (soft + cache_stale_ttl_seconds)."""
+    soft_ttl = jittered_ttl(ttl)
+    entry = {SWR_MARKER: 1, "value": value, "stale_at": time.time() + soft_ttl}
+    await cache.set(key, entry, ttl=soft_ttl + config.cache_stale_ttl_seconds)
+
+
+async def get_entry(key: str) -> Tuple[Any, bool]:
+    """Return (value, is_stale) for a key. Entries written before stale-while-revalidate are never stale."""
+    entry = await cache.get(key)
+    if entry is None:
+        return None, False
+    if isinstance(entry, dict) and SWR_MARKER in entry:
+        return entry["value"], time.time() >= entry["stale_at"]
+    return entry, False
+
+
+def refresh_in_background(
+    key: str,
+    func: Callable[[], Awaitable[Any]],
+    flight: Optional[SingleFlight] = None,
+    check: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> None:
+    """Refresh a stale entry without blocking the caller, at most once at a time per key."""
+    flight = flight or _refreshes
+    if flight.in_flight(key):
+        return
+
+    async def refresh():
+        try:
+            await flight.do(key, func, check=check)
+            logger.debug(f"Refreshed stale cache entry {key}")
+        except Exception as e:
+            logger.error(f"Error refreshing cache entry {key}: {str(e)}")
+
+    task = asyncio.create_task(refresh())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 def cached_decorator(
     ttl=config.cache_ttl_seconds, key_builder=default_key_builder, key_prefix=None, namespace=None
 ):
@@ -57,14 +268,18 @@ def cached_decorator(
             else:
                 key = key_builder(func, *args, **kwargs)
 
-            result = await cache.get(key)
-            if result is not None:
+            async def refresh():
+                result = await func(*args, **kwargs)
+                await set_entry(key, result, ttl=ttl)
                 return result
 
-            result = await func(*args, **kwargs)
+            result, stale = await get_entry(key)
+            if result is not None:
+                if stale:
+                    refresh_in_background(key, refresh)
+                return result
 
-            await cache.set(key, result, ttl=ttl)
-            return result
+            return await _refreshes.do(key, refresh)
 
         for attr in dir(func):
             if not attr.startswith("__"):
@@ -75,20 +290,85 @@ def cached_decorator(
     return wrapper
 
 
-async def get_cache_info():
+async def get_cache_summary() -> Dict[str, Any]:
+    """Cheap O(1) cache overview from INFO and DBSIZE, safe to call on startup."""
     try:
-        keys = await cache.raw("keys", "*")
-        total_size = 0
-        item_count = len(keys)
+        info = await cache.raw("info", "memory")
+        return {
+            "used_memory_mb": round(info.get("used_memory", 0) / (1024 * 1024), 2),
+            "item_count": await cache.raw("dbsize"),
+        }
+    except Exception as e:
+        logger.error(f"Error getting cache summary: {str(e)}")
+        return {"used_memory_mb": 0, "item_count": 0}
 
-        for key in keys:
-            value = await cache.raw("get", key)
-            total_size += len(value) if value else 0
 
-        return {
-            "total_size_mb": round(total_size / (1024 * 1024), 2),
+_cache_info = {"computed_at": 0.0, "data": None}
+
+
+async def get_cache_info(sample_size: int = 1000, max_age: int = 60) -> Dict[str, Any]:
+    """Estimate cache size per namespace.
+
+    Walks the keyspace incrementally with SCAN and samples MEMORY USAGE for up to
+    sample_size keys, then extrapolates to DBSIZE. Results are reused for max_age seconds.
+    """
+    if _cache_info["data"] and time.monotonic() - _cache_info["computed_at"] < max_age:
+        return _cache_info["data"]
+
+    try:
+        prefix = cache.build_key("")
+        summary = await get_cache_summary()
+        item_count = summary["item_count"]
+
+        sampled_keys = []
+        cursor = 0
+        while len(sampled_keys) < sample_size:
+            cursor, keys = await cache.raw("scan", cursor, match=f"{prefix}*", count=500)
+            sampled_keys.extend(keys)
+            if not cursor:
+                break
+        sampled_keys = sampled_keys[:sample_size]
+
+        sizes = []
+        if sampled_keys:
+            async with cache.client.pipeline(transaction=False) as pipe:
+                for key in sampled_keys:
+                    pipe.memory_usage(key)
+                sizes = await pipe.execute()
+
+        namespaces = {}
+        for key, size in zip(sampled_keys, sizes):
+            if isinstance(key, bytes):
+                key = key.decode(errors="replace")
+            namespace = namespaces.setdefault(
+                key_namespace(key[len(prefix):]), {"sampled_keys": 0, "sampled_bytes": 0}
+            )
+            namespace["sampled_keys"] += 1
+            namespace["sampled_bytes"] += size or 0
+
+        # Scale the sample up to the whole keyspace
+        scale = item_count / len(sampled_keys) if sampled_keys else 0
+        total_bytes = 0
+        for namespace in namespaces.values():
+            namespace["estimated_keys"] = round(namespace["sampled_keys"] * scale)
+            namespace["estimated_size_mb"] = round(namespace["sampled_bytes"] * scale / (1024 * 1024), 2)
+            total_bytes += namespace["sampled_bytes"] * scale
+
+        data = {
+            "total_size_mb": round(total_bytes / (1024 * 1024), 2),
             "item_count": item_count,
+            "used_memory_mb": summary["used_memory_mb"],
+            "sampled_keys": len(sampled_keys),
+            "namespaces": namespaces,
+            "counters": cache_stats.snapshot(),
+            "local_cache": {
+                "items": len(cache.local),
+                "size_mb": round(cache.local.size / (1024 * 1024), 2),
+                "max_size_mb": round(cache.local.max_bytes / (1024 * 1024), 2),
+            },
         }
+        _cache_info.update(computed_at=time.monotonic(), data=data)
+        return data
     except Exception as e:
         logger.error(f"Error getting cache info: {str(e)}")
         return {"total_size_mb": 0, "item_count": 0}
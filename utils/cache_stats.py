@@ -0,0 +1,31 @@
+from collections import defaultdict
+from typing import Dict
+
+
+def key_namespace(key: str) -> str:
+    """raw_streams:tt123:1:2 -> raw_streams"""
+    return key.split(":", 1)[0]
+
+
+class CacheStats:
+    """Per-namespace cache counters, updated in-process as reads and writes happen."""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"writes": 0, "bytes_written": 0, "local_hits": 0, "redis_hits": 0, "misses": 0}
+        )
+
+    def record_write(self, key: str, size: int) -> None:
+        counters = self._counters[key_namespace(key)]
+        counters["writes"] += 1
+        counters["bytes_written"] += size
+
+    def record_read(self, key: str, source: str) -> None:
+        """source is one of local_hits, redis_hits or misses."""
+        self._counters[key_namespace(key)][source] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {namespace: dict(counters) for namespace, counters in self._counters.items()}
+
+
+cache_stats = CacheStats()
@@ -0,0 +1,156 @@
+import time
+from collections import deque
+from typing import Dict
+
+from utils.config import config
+from utils.logger import logger
+
+
+class CircuitBreaker:
+    """Tracks the health of one upstream service.
+
+    closed: requests pass through, outcomes are recorded in a rolling window.
+    open: requests are rejected until open_seconds have passed.
+    half_open: a limited number of probe requests decide whether to close or re-open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 10,
+        slow_call_rate_threshold: float = 0.8,
+        open_seconds: float = 60,
+        window_size: int = 20,
+        minimum_calls: int = 5,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.minimum_calls = minimum_calls
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.last_error = None
+        self._window = deque(maxlen=window_size)
+        self._probes_in_flight = 0
+
+    def allow_request(self) -> bool:
+        """Check whether a request may be sent, moving to half-open once the open period is over.
+
+        A request allowed while half-open is a probe and must be ended with
+        release_probe() however it finishes, also when it is cancelled.
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self._probes_in_flight = 0
+            logger.info(f"Circuit breaker | {self.name} half-open, sending probe request")
+
+        if self.state == self.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_max_calls:
+                return False
+            self._probes_in_flight += 1
+
+        return True
+
+    @property
+    def is_probing(self) -> bool:
+        return self.state == self.HALF_OPEN
+
+    def release_probe(self) -> None:
+        self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record_success(self, latency: float) -> None:
+        slow = latency >= self.slow_call_seconds
+        if self.state == self.HALF_OPEN:
+            if slow:
+                self._open(f"Probe too slow ({latency:.1f}s)")
+            else:
+                self._close()
+            return
+
+        self._window.append((True, slow, latency))
+        self._evaluate()
+
+    def record_failure(self, latency: float, error: str = "") -> None:
+        self.last_error = error
+        if self.state == self.HALF_OPEN:
+            self._open(f"Probe failed: {error}")
+            return
+
+        self._window.append((False, latency >= self.slow_call_seconds, latency))
+        self._evaluate()
+
+    def _evaluate(self) -> None:
+        if self.state != self.CLOSED or len(self._window) < self.minimum_calls:
+            return
+        if self.failure_rate >= self.failure_rate_threshold:
+            self._open(f"Failure rate {self.failure_rate:.0%}")
+        elif self.slow_call_rate >= self.slow_call_rate_threshold:
+            self._open(f"Slow call rate {self.slow_call_rate:.0%}")
+
+    def _open(self, reason: str) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        logger.warning(f"Circuit breaker | {self.name} opened ({reason}), skipping for {self.open_seconds}s")
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self._window.clear()
+        logger.info(f"Circuit breaker | {self.name} closed")
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._window:
+            return 0.0
+        return sum(1 for success, _, _ in self._window if not success) / len(self._window)
+
+    @property
+    def slow_call_rate(self) -> float:
+        if not self._window:
+            return 0.0
+        return sum(1 for _, slow, _ in self._window if slow) / len(self._window)
+
+    def snapshot(self) -> Dict:
+        """Current health state for the admin endpoint."""
+        latencies = [latency for _, _, latency in self._window]
+        retry_in = 0
+        if self.state == self.OPEN:
+            retry_in = max(0, round(self.open_seconds - (time.monotonic() - self.opened_at)))
+        return {
+            "name": self.name,
+            "state": self.state,
+            "calls": len(self._window),
+            "failure_rate": round(self.failure_rate, 2),
+            "slow_call_rate": round(self.slow_call_rate, 2),
+            "avg_latency_seconds": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "retry_in_seconds": retry_in,
+            "last_error": self.last_error,
+        }
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for a service."""
+    breaker = _circuit_breakers.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            name,
+            failure_rate_threshold=config.circuit_breaker_failure_rate,
+            slow_call_seconds=config.circuit_breaker_slow_call_seconds,
+            open_seconds=config.circuit_breaker_open_seconds,
+        )
+        _circuit_breakers[name] = breaker
+    return breaker
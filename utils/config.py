@@ -34,50 +34,6 @@ class Config:
                 return None
         return value
 
-    def get_user_vidi_mode(self, username: str) -> bool:
-        users_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), "db/users.json"
-        )
-        try:
-            with open(users_path, "r") as f:
-                users = json.load(f)
-                return users.get(username, {}).get("vidi_mode", False)
-        except Exception:
-            return False
-
-    def get_user_simple_format(self, username: str) -> bool:
-        users_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), "db/users.json"
-        )
-        try:
-            with open(users_path, "r") as f:
-                users = json.load(f)
-                return users.get(username, {}).get("simple_format", False)
-        except Exception:
-            return False
-
-    def get_user_one_per_quality(self, username: str) -> bool:
-        users_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), "db/users.json"
-        )
-        try:
-            with open(users_path, "r") as f:
-                users = json.load(f)
-                return users.get(username, {}).get("one_per_quality", False)
-        except Exception:
-            return False
-
-    def get_user_cached_only(self, username: str) -> bool:
-        users_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), "db/users.json"
-        )
-        try:
-            with open(users_path, "r") as f:
-                users = json.load(f)
-                return users.get(username, {}).get("cached_only", False)
-        except Exception:
-            return False
-
     @property
     def debrid_service(self) -> str:
         return self._config.get("debrid_service")
@@ -108,10 +64,74 @@ class Config:
     def mediaflow_enabled(self) -> bool:
         return self._config.get("mediaflow_enabled", True)
 
+    @property
+    def mediaflow_local_urls(self) -> bool:
+        return self._config.get("mediaflow_local_urls", True)
+
+    @property
+    def mediaflow_concurrency(self) -> int:
+        return self._config.get("mediaflow_concurrency", 8)
+
     @property
     def cache_ttl_seconds(self) -> int:
         return self._config.get("cache_ttl_seconds", 60)
 
+    @property
+    def cache_stale_ttl_seconds(self) -> int:
+        return self._config.get("cache_stale_ttl_seconds", 86400)
+
+    @property
+    def cache_ttl_jitter(self) -> float:
+        return self._config.get("cache_ttl_jitter", 0.1)
+
+    @property
+    def cache_serializer(self) -> str:
+        return self._config.get("cache_serializer", "msgpack")
+
+    @property
+    def cache_compression(self) -> str:
+        return self._config.get("cache_compression", "zstd")
+
+    @property
+    def cache_compression_threshold_bytes(self) -> int:
+        return self._config.get("cache_compression_threshold_bytes", 1024)
+
+    @property
+    def local_cache_size_mb(self) -> int:
+        return self._config.get("local_cache_size_mb", 64)
+
+    @property
+    def local_cache_ttl_seconds(self) -> int:
+        return self._config.get("local_cache_ttl_seconds", 300)
+
+    @property
+    def stream_timeout_seconds(self) -> float:
+        return self._config.get("stream_timeout_seconds", 10)
+
+    @property
+    def service_timeout_seconds(self) -> float:
+        return self._config.get("service_timeout_seconds", 30)
+
+    @property
+    def redis_single_flight(self) -> bool:
+        return self._config.get("redis_single_flight", False)
+
+    @property
+    def degraded_cache_ttl_seconds(self) -> int:
+        return self._config.get("degraded_cache_ttl_seconds", 300)
+
+    @property
+    def circuit_breaker_failure_rate(self) -> float:
+        return self._config.get("circuit_breaker_failure_rate", 0.5)
+
+    @property
+    def circuit_breaker_slow_call_seconds(self) -> float:
+        return self._config.get("circuit_breaker_slow_call_seconds", 10)
+
+    @property
+    def circuit_breaker_open_seconds(self) -> float:
+        return self._config.get("circuit_breaker_open_seconds", 60)
+
     @property
     def buffer_size_mb(self) -> int:
         return self._config.get("buffer_size_mb", 256)
@@ -120,5 +140,81 @@ class Config:
     def chunk_size_mb(self) -> int:
         return self._config.get("chunk_size_mb", 4)
 
+    @property
+    def proxy_max_retries(self) -> int:
+        return self._config.get("proxy_max_retries", 5)
+
+    @property
+    def proxy_parallel_connections(self) -> int:
+        return self._config.get("proxy_parallel_connections", 1)
+
+    @property
+    def proxy_link_ttl_hours(self) -> int:
+        return self._config.get("proxy_link_ttl_hours", 0)
+
+    @property
+    def proxy_connections_per_host(self) -> int:
+        return self._config.get("proxy_connections_per_host", 0)
+
+    @property
+    def proxy_keepalive_seconds(self) -> float:
+        return self._config.get("proxy_keepalive_seconds", 60)
+
+    @property
+    def proxy_shared_window_mb(self) -> int:
+        return self._config.get("proxy_shared_window_mb", 16)
+
+    @property
+    def proxy_bandwidth_limit_mbps(self) -> float:
+        return self._config.get("proxy_bandwidth_limit_mbps", 0)
+
+    @property
+    def proxy_user_limit_mbps(self) -> float:
+        return self._config.get("proxy_user_limit_mbps", 0)
+
+    @property
+    def proxy_session_limit_mbps(self) -> float:
+        return self._config.get("proxy_session_limit_mbps", 0)
+
+    @property
+    def proxy_min_session_mbps(self) -> float:
+        return self._config.get("proxy_min_session_mbps", 25)
+
+    @property
+    def segment_cache_dir(self) -> str:
+        return self._config.get("segment_cache_dir", "data/segments")
+
+    @property
+    def segment_cache_size_mb(self) -> int:
+        return self._config.get("segment_cache_size_mb", 0)
+
+    @property
+    def segment_cache_block_mb(self) -> int:
+        return self._config.get("segment_cache_block_mb", 4)
+
+    @property
+    def proxy_memory_budget_mb(self) -> int:
+        return self._config.get("proxy_memory_budget_mb", 1024)
+
+    @property
+    def proxy_min_buffer_mb(self) -> int:
+        return self._config.get("proxy_min_buffer_mb", 16)
+
+    @property
+    def upstream_http2(self) -> bool:
+        return self._config.get("upstream_http2", False)
+
+    @property
+    def upstream_max_connections(self) -> int:
+        return self._config.get("upstream_max_connections", 20)
+
+    @property
+    def upstream_max_keepalive_connections(self) -> int:
+        return self._config.get("upstream_max_keepalive_connections", 10)
+
+    @property
+    def upstream_keepalive_expiry(self) -> float:
+        return self._config.get("upstream_keepalive_expiry", 60)
+
 
 config = Config()
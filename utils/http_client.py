@@ -0,0 +1,85 @@
+from typing import Dict, Optional
+
+import httpx
+
+from utils.config import config
+from utils.logger import logger
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class HTTPClientRegistry:
+    """Long-lived httpx clients for upstream addons, one keep-alive pool per service."""
+
+    def __init__(self):
+        self._settings: Dict[str, Dict] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def register(
+        self,
+        name: str,
+        config_key: Optional[str] = None,
+        timeout: float = 5.0,
+        proxy: Optional[str] = None,
+    ) -> None:
+        """Register client settings for a service. Per-addon limits in addon_config override the defaults."""
+        config_key = config_key or name.lower()
+        self._settings[name] = {
+            "timeout": timeout,
+            "proxy": proxy,
+            "max_connections": config.get("addon_config", config_key, "max_connections")
+            or config.upstream_max_connections,
+            "max_keepalive_connections": config.get("addon_config", config_key, "max_keepalive_connections")
+            or config.upstream_max_keepalive_connections,
+            "http2": config.upstream_http2,
+        }
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Return the shared client for a service, creating it on first use."""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self._clients[name] = client
+        return client
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        settings = self._settings.get(name)
+        if settings is None:
+            self.register(name)
+            settings = self._settings[name]
+
+        http2 = settings["http2"]
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning(f"HTTP/2 requested for {name} but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive_connections"],
+            keepalive_expiry=config.upstream_keepalive_expiry,
+        )
+        # Limits and proxy have to live on the transport, the client ignores them once a transport is given
+        transport = httpx.AsyncHTTPTransport(
+            proxy=settings["proxy"],
+            limits=limits,
+            http2=http2,
+        )
+        logger.debug(f"Creating upstream client for {name} (http2: {http2}, limits: {limits})")
+        return httpx.AsyncClient(timeout=settings["timeout"], transport=transport)
+
+    async def aclose(self) -> None:
+        """Close all pooled clients."""
+        for name, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Error closing upstream client for {name}: {str(e)}")
+        self._clients.clear()
+
+
+http_clients = HTTPClientRegistry()
@@ -0,0 +1,80 @@
+import base64
+import json
+import os
+import time
+from typing import Dict, Optional
+from urllib.parse import urlencode, urljoin
+
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+# Sent by the player with every request, MediaFlow ignores them when encoded in the URL
+DYNAMIC_REQUEST_HEADERS = ("range", "if-range")
+
+
+class MediaFlowEncoder:
+    """Builds MediaFlow proxy URLs locally, the same way MediaFlow's URL generation endpoint does.
+
+    With an API password the parameters, including the password MediaFlow checks,
+    are encrypted into a token MediaFlow decrypts with the same password:
+    AES-256-CBC with PKCS7 padding, the password padded or cut to 32 bytes as key,
+    and a random IV prepended to the ciphertext. Without one they are sent as
+    plain query parameters.
+    """
+
+    def __init__(self, api_password: Optional[str]):
+        self.api_password = api_password
+        self.key = api_password.encode("utf-8").ljust(32)[:32] if api_password else None
+
+    def encode_url(
+        self,
+        mediaflow_proxy_url: str,
+        endpoint: Optional[str],
+        destination_url: Optional[str],
+        query_params: Optional[Dict] = None,
+        request_headers: Optional[Dict] = None,
+        response_headers: Optional[Dict] = None,
+        expiration: Optional[int] = None,
+    ) -> str:
+        params = dict(query_params or {})
+        if self.api_password:
+            params.setdefault("api_password", self.api_password)
+        if destination_url is not None:
+            params["d"] = destination_url
+        params.update({
+            k if k.lower().startswith("h_") else f"h_{k}": v
+            for k, v in (request_headers or {}).items()
+            if v and k.lower().removeprefix("h_") not in DYNAMIC_REQUEST_HEADERS
+        })
+        params.update({
+            k if k.lower().startswith("r_") else f"r_{k}": v
+            for k, v in (response_headers or {}).items()
+            if v
+        })
+
+        if self.key:
+            encoded_params = urlencode({"token": self.encrypt(params, expiration)})
+        else:
+            encoded_params = urlencode(params)
+
+        base_url = urljoin(mediaflow_proxy_url, endpoint) if endpoint else mediaflow_proxy_url
+        return f"{base_url.rstrip('/')}?{encoded_params}"
+
+    def encrypt(self, data: Dict, expiration: Optional[int] = None) -> str:
+        if expiration:
+            data = {**data, "exp": int(time.time()) + expiration}
+        padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        padded = padder.update(json.dumps(data).encode("utf-8")) + padder.finalize()
+
+        iv = os.urandom(16)
+        encryptor = Cipher(algorithms.AES(self.key), modes.CBC(iv)).encryptor()
+        encrypted = encryptor.update(padded) + encryptor.finalize()
+        return base64.urlsafe_b64encode(iv + encrypted).decode("utf-8").rstrip("=")
+
+    def decrypt(self, token: str) -> Dict:
+        """Decrypt a token made by MediaFlow or encrypt(), expiry is returned in exp and not checked."""
+        data = base64.urlsafe_b64decode((token + "=" * (-len(token) % 4)).encode("utf-8"))
+        decryptor = Cipher(algorithms.AES(self.key), modes.CBC(data[:16])).decryptor()
+        padded = decryptor.update(data[16:]) + decryptor.finalize()
+        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        return json.loads(unpadder.update(padded) + unpadder.finalize())
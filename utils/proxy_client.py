@@ -0,0 +1,65 @@
+import ssl
+from typing import Optional
+
+import aiohttp
+
+from utils.config import config
+from utils.logger import logger
+
+
+class ProxyClient:
+    """A long-lived aiohttp session with its own connector.
+
+    proxy_client is shared by every proxied stream. Keeping one connector means
+    idle keep-alive connections, DNS lookups and the TLS context are reused
+    between range requests, so a seek or the next segment usually skips
+    connection setup. The number of streams is governed by the proxy's buffer
+    budget. mediaflow_client is kept separate so URL generation never waits
+    behind connections held by streams.
+    """
+
+    def __init__(self, connections_per_host: int, keepalive_seconds: float):
+        self.connections_per_host = connections_per_host
+        self.keepalive_seconds = keepalive_seconds
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it on first use inside the event loop."""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        timeout = aiohttp.ClientTimeout(total=None, connect=120, sock_read=120)
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=self.connections_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=self.keepalive_seconds,
+            # One context for all connections instead of loading the CA store per request
+            ssl=ssl.create_default_context(),
+            enable_cleanup_closed=True,
+        )
+        logger.debug(
+            f"Creating proxy client (connections per host: {self.connections_per_host or 'unlimited'})"
+        )
+        return aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            try:
+                await self._session.close()
+            except Exception as e:
+                logger.error(f"Error closing proxy client: {str(e)}")
+        self._session = None
+
+
+proxy_client = ProxyClient(
+    config.proxy_connections_per_host,
+    config.proxy_keepalive_seconds,
+)
+mediaflow_client = ProxyClient(
+    config.mediaflow_concurrency,
+    config.proxy_keepalive_seconds,
+)
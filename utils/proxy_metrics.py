@@ -0,0 +1,193 @@
+import itertools
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from utils.stream_buffer import StreamBuffer
+
+# Waiting longer than this for the next chunk after playback started counts as a stall
+STALL_SECONDS = 1.0
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+
+    def render(self, name: str) -> List[str]:
+        lines = [f'{name}_bucket{{le="{bucket}"}} {count}' for bucket, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class ProxySession:
+    """Live numbers for one proxied response."""
+
+    def __init__(self, session_id: int, username: Optional[str], url: str):
+        self.id = session_id
+        self.username = username
+        self.host = urlparse(url).hostname or "unknown"
+        self.source = "upstream"
+        self.buffer: Optional[StreamBuffer] = None
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.first_byte: Optional[float] = None
+        self.bytes_sent = 0
+        self.stalls = 0
+        self.stall_seconds = 0.0
+
+    @property
+    def ttfb(self) -> Optional[float]:
+        return self.first_byte - self.started if self.first_byte is not None else None
+
+    @property
+    def rate(self) -> float:
+        """Average bytes per second since the first byte."""
+        if self.first_byte is None:
+            return 0.0
+        elapsed = time.monotonic() - self.first_byte
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self) -> Dict:
+        buffer_fill = None
+        if self.buffer is not None and self.buffer.max_bytes:
+            buffer_fill = round(self.buffer.size / self.buffer.max_bytes, 2)
+        return {
+            "id": self.id,
+            "user": self.username,
+            "upstream_host": self.host,
+            "source": self.source,
+            "started_at": self.started_at,
+            "duration_seconds": round(time.monotonic() - self.started, 1),
+            "ttfb_seconds": round(self.ttfb, 3) if self.ttfb is not None else None,
+            "bytes_sent": self.bytes_sent,
+            "rate_mbps": round(self.rate * 8 / 1000 / 1000, 2),
+            "buffer_fill": buffer_fill,
+            "buffered_mb": round(self.buffer.size / 1024 / 1024, 1) if self.buffer is not None else None,
+            "stalls": self.stalls,
+            "stall_seconds": round(self.stall_seconds, 1),
+        }
+
+
+class ProxyMetrics:
+    """Registry of active proxy sessions plus Prometheus style counters and histograms."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.sessions: Dict[int, ProxySession] = {}
+        self.sessions_total = 0
+        self.rejected_total = 0
+        self.stalls_total = 0
+        self.bytes_by_host: Dict[str, int] = defaultdict(int)
+        self.reconnects_by_host: Dict[str, int] = defaultdict(int)
+        self.sessions_by_source: Dict[str, int] = defaultdict(int)
+        self.ttfb = Histogram((0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+        self.throughput = Histogram((1, 5, 10, 25, 50, 100, 250, 500))
+        self.stall_duration = Histogram((1, 2.5, 5, 10, 30, 60))
+
+    def start_session(self, username: Optional[str], url: str) -> ProxySession:
+        session = ProxySession(next(self._ids), username, url)
+        self.sessions[session.id] = session
+        self.sessions_total += 1
+        return session
+
+    def end_session(self, session: ProxySession) -> None:
+        if self.sessions.pop(session.id, None) is None:
+            return
+        self.sessions_by_source[session.source] += 1
+        if session.first_byte is not None and time.monotonic() - session.first_byte >= 1:
+            self.throughput.observe(session.rate * 8 / 1000 / 1000)
+
+    def record_chunk(self, session: ProxySession, size: int, waited: float) -> None:
+        now = time.monotonic()
+        if session.first_byte is None:
+            session.first_byte = now
+            self.ttfb.observe(session.ttfb)
+        elif waited >= STALL_SECONDS:
+            session.stalls += 1
+            session.stall_seconds += waited
+            self.stalls_total += 1
+            self.stall_duration.observe(waited)
+        session.bytes_sent += size
+        self.bytes_by_host[session.host] += size
+
+    def record_reconnect(self, url: str) -> None:
+        self.reconnects_by_host[urlparse(url).hostname or "unknown"] += 1
+
+    def record_rejected(self) -> None:
+        self.rejected_total += 1
+
+    def snapshot(self) -> List[Dict]:
+        return [session.snapshot() for session in self.sessions.values()]
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP aiostremio_proxy_active_sessions Proxied responses currently streaming.",
+            "# TYPE aiostremio_proxy_active_sessions gauge",
+            f"aiostremio_proxy_active_sessions {len(self.sessions)}",
+            "# HELP aiostremio_proxy_buffered_bytes Bytes buffered across active sessions.",
+            "# TYPE aiostremio_proxy_buffered_bytes gauge",
+            f"aiostremio_proxy_buffered_bytes {sum(s.buffer.size for s in self.sessions.values() if s.buffer is not None)}",
+            "# HELP aiostremio_proxy_sessions_total Proxied responses started.",
+            "# TYPE aiostremio_proxy_sessions_total counter",
+            f"aiostremio_proxy_sessions_total {self.sessions_total}",
+            "# HELP aiostremio_proxy_rejected_total Proxy requests refused because the buffer budget was exhausted.",
+            "# TYPE aiostremio_proxy_rejected_total counter",
+            f"aiostremio_proxy_rejected_total {self.rejected_total}",
+            "# HELP aiostremio_proxy_stalls_total Waits of more than a second for data after playback started.",
+            "# TYPE aiostremio_proxy_stalls_total counter",
+            f"aiostremio_proxy_stalls_total {self.stalls_total}",
+            "# HELP aiostremio_proxy_completed_sessions_total Finished proxied responses by where they were served from.",
+            "# TYPE aiostremio_proxy_completed_sessions_total counter",
+        ]
+        lines += [
+            f'aiostremio_proxy_completed_sessions_total{{source="{source}"}} {count}'
+            for source, count in self.sessions_by_source.items()
+        ]
+        lines += [
+            "# HELP aiostremio_proxy_bytes_sent_total Bytes sent to clients by upstream host.",
+            "# TYPE aiostremio_proxy_bytes_sent_total counter",
+        ]
+        lines += [
+            f'aiostremio_proxy_bytes_sent_total{{host="{host}"}} {count}'
+            for host, count in self.bytes_by_host.items()
+        ]
+        lines += [
+            "# HELP aiostremio_proxy_upstream_reconnects_total Upstream reconnects and segment retries by host.",
+            "# TYPE aiostremio_proxy_upstream_reconnects_total counter",
+        ]
+        lines += [
+            f'aiostremio_proxy_upstream_reconnects_total{{host="{host}"}} {count}'
+            for host, count in self.reconnects_by_host.items()
+        ]
+        lines += [
+            "# HELP aiostremio_proxy_ttfb_seconds Time from request to first byte sent.",
+            "# TYPE aiostremio_proxy_ttfb_seconds histogram",
+        ]
+        lines += self.ttfb.render("aiostremio_proxy_ttfb_seconds")
+        lines += [
+            "# HELP aiostremio_proxy_throughput_mbps Average rate of finished sessions.",
+            "# TYPE aiostremio_proxy_throughput_mbps histogram",
+        ]
+        lines += self.throughput.render("aiostremio_proxy_throughput_mbps")
+        lines += [
+            "# HELP aiostremio_proxy_stall_seconds Duration of stalls.",
+            "# TYPE aiostremio_proxy_stall_seconds histogram",
+        ]
+        lines += self.stall_duration.render("aiostremio_proxy_stall_seconds")
+        return "\n".join(lines) + "\n"
+
+
+proxy_metrics = ProxyMetrics()
@@ -4,11 +4,9 @@ import time
 import asyncio
 import aiohttp
 from utils.logger import logger
-from utils.config import config
 from utils.service_manager import ServiceManager
 from services.base import StreamingService
 from typing import List
-from utils.cache import cache
 
 _caching_seasons = set()
 
@@ -61,11 +59,10 @@ async def cache_season(meta_id: str, services: List[StreamingService]):
                                     
                                     # Fetch streams using ServiceManager
                                     try:
-                                        streams = await service_manager.fetch_all_streams(ep_meta_id)
+                                        streams = await service_manager.fetch_all_streams(
+                                            ep_meta_id, cache_results=True
+                                        )
                                         if streams:
-                                            # Store streams in Redis cache
-                                            cache_key = f"raw_streams:{ep_meta_id}"
-                                            await cache.set(cache_key, {"streams": streams}, ttl=config.cache_ttl_seconds)
                                             logger.info(f"Successfully cached streams for {ep_name}")
                                         else:
                                             logger.warning(f"No streams found for {ep_name}")
@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from utils.config import config
+from utils.logger import logger
+
+
+class SegmentCache:
+    """Disk cache of aligned byte blocks from proxied files.
+
+    Each upstream file is identified by a hash of its URL and stored as one file
+    per block_size block under <directory>/<key>/, next to a meta.json holding
+    the file size, content type and validator. Blocks are evicted least recently
+    used first once the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, block_size: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.total_bytes = 0
+        self._blocks: "OrderedDict[Tuple[str, int], int]" = OrderedDict()
+        self._block_counts: Dict[str, int] = {}
+        self._metadata: Dict[str, Dict] = {}
+        if self.enabled:
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def resource_key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def get_metadata(self, key: str) -> Optional[Dict]:
+        return self._metadata.get(key)
+
+    def set_metadata(self, key: str, size: int, content_type: str, validator: Optional[str]) -> None:
+        current = self._metadata.get(key)
+        if current and (current["size"], current["validator"]) == (size, validator):
+            return
+        if current:
+            # The upstream file changed, blocks cached from the old one are useless
+            logger.info(f"Segment cache | {key} changed upstream, dropping cached blocks")
+            self._drop_resource(key)
+
+        metadata = {"size": size, "content_type": content_type, "validator": validator}
+        self._metadata[key] = metadata
+        try:
+            os.makedirs(self._resource_dir(key), exist_ok=True)
+            self._write_file(os.path.join(self._resource_dir(key), "meta.json"), json.dumps(metadata).encode())
+        except OSError as e:
+            logger.error(f"Segment cache | Error writing metadata for {key}: {str(e)}")
+
+    def has_block(self, key: str, index: int) -> bool:
+        return (key, index) in self._blocks
+
+    async def read_block(self, key: str, index: int) -> Optional[bytes]:
+        if (key, index) not in self._blocks:
+            return None
+        self._blocks.move_to_end((key, index))
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self._read_file, self._block_path(key, index)
+            )
+        except OSError as e:
+            logger.error(f"Segment cache | Error reading block {index} of {key}: {str(e)}")
+            self._forget_block(key, index)
+            return None
+
+    async def write_block(self, key: str, index: int, data: bytes) -> None:
+        if (key, index) in self._blocks or key not in self._metadata:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_file, self._block_path(key, index), data)
+        except OSError as e:
+            logger.error(f"Segment cache | Error writing block {index} of {key}: {str(e)}")
+            return
+
+        if key not in self._metadata:
+            # Dropped while the block was being written
+            await loop.run_in_executor(None, self._unlink, self._block_path(key, index))
+            return
+        self._blocks[(key, index)] = len(data)
+        self._block_counts[key] = self._block_counts.get(key, 0) + 1
+        self.total_bytes += len(data)
+
+        victims = self._collect_victims()
+        if victims:
+            await loop.run_in_executor(None, self._remove_files, victims)
+
+    def writer(self, key: str, offset: int) -> "SegmentWriter":
+        return SegmentWriter(self, key, offset)
+
+    def _collect_victims(self) -> List[str]:
+        victims = []
+        while self.total_bytes > self.max_bytes and self._blocks:
+            key, index = next(iter(self._blocks))
+            victims.append(self._block_path(key, index))
+            if self._forget_block(key, index):
+                victims.append(self._resource_dir(key))
+        return victims
+
+    def _forget_block(self, key: str, index: int) -> bool:
+        """Remove a block from the index, returns True if it was the last block of its file."""
+        size = self._blocks.pop((key, index), None)
+        if size is None:
+            return False
+        self.total_bytes -= size
+        self._block_counts[key] -= 1
+        if self._block_counts[key] > 0:
+            return False
+        del self._block_counts[key]
+        self._metadata.pop(key, None)
+        return True
+
+    def _drop_resource(self, key: str) -> None:
+        for block in [block for block in self._blocks if block[0] == key]:
+            self.total_bytes -= self._blocks.pop(block)
+        self._block_counts.pop(key, None)
+        self._metadata.pop(key, None)
+        self._remove_files([self._resource_dir(key)])
+
+    def _load_index(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        blocks = []
+        for key in os.listdir(self.directory):
+            resource_dir = self._resource_dir(key)
+            try:
+                with open(os.path.join(resource_dir, "meta.json"), "r") as f:
+                    self._metadata[key] = json.load(f)
+                for name in os.listdir(resource_dir):
+                    if name.endswith(".tmp"):
+                        self._unlink(os.path.join(resource_dir, name))
+                    elif name.endswith(".blk"):
+                        stat = os.stat(os.path.join(resource_dir, name))
+                        blocks.append((stat.st_mtime, key, int(name[:-4]), stat.st_size))
+            except (OSError, ValueError):
+                self._remove_files([resource_dir])
+
+        # Oldest first so the least recently written blocks are evicted first
+        for _, key, index, size in sorted(blocks):
+            self._blocks[(key, index)] = size
+            self._block_counts[key] = self._block_counts.get(key, 0) + 1
+            self.total_bytes += size
+        for key in [key for key in self._metadata if key not in self._block_counts]:
+            del self._metadata[key]
+        self._remove_files(self._collect_victims())
+        logger.info(
+            f"Segment cache | {len(self._blocks)} blocks, {self.total_bytes / 1024 / 1024:.0f} MB in {self.directory}"
+        )
+
+    def _resource_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _block_path(self, key: str, index: int) -> str:
+        return os.path.join(self.directory, key, f"{index}.blk")
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _write_file(path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            SegmentCache._unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove_files(paths: List[str]) -> None:
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                SegmentCache._unlink(path)
+
+
+class SegmentWriter:
+    """Collects bytes streamed from upstream into aligned blocks and writes them through.
+
+    Bytes before the first block boundary are skipped, the last block of a file
+    may be shorter than block_size.
+    """
+
+    def __init__(self, cache: SegmentCache, key: str, offset: int):
+        self.cache = cache
+        self.key = key
+        self.offset = offset
+        self._index = -(-offset // cache.block_size)
+        self._block = bytearray()
+
+    async def feed(self, chunk: bytes) -> None:
+        metadata = self.cache.get_metadata(self.key)
+        if metadata is None:
+            return
+
+        start = self.offset
+        self.offset += len(chunk)
+        block_start = self._index * self.cache.block_size
+        if start < block_start:
+            if self.offset <= block_start:
+                return
+            chunk = chunk[block_start - start:]
+        self._block += chunk
+
+        block_size = self.cache.block_size
+        while self._block and (
+            len(self._block) >= block_size
+            or self._index * block_size + len(self._block) >= metadata["size"]
+        ):
+            block = bytes(self._block[:block_size])
+            del self._block[:block_size]
+            await self.cache.write_block(self.key, self._index, block)
+            self._index += 1
+
+
+def _segment_cache_dir() -> str:
+    directory = config.segment_cache_dir
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.dirname(__file__)), directory)
+    return directory
+
+
+segment_cache = SegmentCache(
+    _segment_cache_dir(),
+    config.segment_cache_size_mb * 1024 * 1024,
+    config.segment_cache_block_mb * 1024 * 1024,
+)
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import aiohttp
+
+from utils.buffer_allocator import buffer_allocator
+from utils.logger import logger
+from utils.proxy_metrics import proxy_metrics
+
+
+class SegmentedReader:
+    """Reads a byte range as consecutive segments fetched over several connections.
+
+    Some CDNs throttle each connection, so the next segments are requested in
+    parallel and returned in order. Parallelism starts at 2 and is tuned per round
+    of segments: it grows while extra connections raise the total throughput and
+    shrinks when they don't. The first segment is read from the response that
+    was already opened for the headers. Every connection beyond the first holds
+    up to a segment in memory, that memory is reserved from buffer_allocator and
+    max_connections is lowered to what was granted. It is returned with
+    release_memory().
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: Dict,
+        response: aiohttp.ClientResponse,
+        start: int,
+        end: int,
+        segment_size: int,
+        max_connections: int,
+        max_retries: int,
+        validator: Optional[str] = None,
+    ):
+        self.session = session
+        self.url = url
+        self.headers = headers
+        self.end = end
+        self.segment_size = segment_size
+        self.max_retries = max_retries
+        self.validator = validator
+
+        # A single segment in flight is what a plain read would hold as well
+        granted = buffer_allocator.reserve((max_connections - 1) * segment_size)
+        self.reserved_bytes = granted // segment_size * segment_size
+        buffer_allocator.unreserve(granted - self.reserved_bytes)
+        self.max_connections = 1 + self.reserved_bytes // segment_size
+        if self.max_connections < max_connections:
+            logger.debug(f"Proxy memory budget allows {self.max_connections} segment connections")
+        self.connections = min(2, self.max_connections)
+
+        self._next_offset = start + segment_size
+        self._pending = deque([asyncio.create_task(self._read_first(response, start))])
+        self._round_bytes = 0
+        self._round_seconds = 0.0
+        self._round_segments = 0
+        self._last_throughput = 0.0
+
+    async def read(self) -> bytes:
+        """Return the next segment, b"" once the range is complete."""
+        while len(self._pending) < self.connections and self._next_offset <= self.end:
+            segment_end = min(self._next_offset + self.segment_size, self.end + 1) - 1
+            self._pending.append(asyncio.create_task(self._fetch(self._next_offset, segment_end)))
+            self._next_offset = segment_end + 1
+
+        if not self._pending:
+            return b""
+        return await self._pending.popleft()
+
+    async def close(self) -> None:
+        for task in self._pending:
+            task.cancel()
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        self._pending.clear()
+
+    def release_memory(self) -> None:
+        buffer_allocator.unreserve(self.reserved_bytes)
+        self.reserved_bytes = 0
+
+    async def _read_first(self, response: aiohttp.ClientResponse, start: int) -> bytes:
+        end = min(start + self.segment_size, self.end + 1) - 1
+        began = time.monotonic()
+        try:
+            data = await response.content.readexactly(end - start + 1)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, aiohttp.ClientError):
+            return await self._fetch(start, end)
+        finally:
+            # Closes the connection, the following segments are requested separately
+            response.release()
+        self._record(len(data), time.monotonic() - began)
+        return data
+
+    async def _fetch(self, start: int, end: int) -> bytes:
+        headers = self.headers.copy()
+        headers["range"] = f"bytes={start}-{end}"
+        if self.validator:
+            headers["If-Range"] = self.validator
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                proxy_metrics.record_reconnect(self.url)
+                await asyncio.sleep(min(0.5 * 2 ** (attempt - 1), 8))
+            began = time.monotonic()
+            try:
+                async with self.session.get(self.url, headers=headers) as response:
+                    content_range = response.headers.get("Content-Range", "")
+                    if response.status != 206 or not content_range.startswith(f"bytes {start}-"):
+                        raise aiohttp.ClientError(
+                            f"Upstream can't serve segment {start}-{end} (status {response.status})"
+                        )
+                    data = await response.read()
+            except (asyncio.TimeoutError, aiohttp.ClientPayloadError, aiohttp.ClientConnectionError) as e:
+                logger.warning(f"Segment {start}-{end} failed: {str(e)}")
+                continue
+
+            if len(data) != end - start + 1:
+                logger.warning(f"Segment {start}-{end} returned {len(data)} bytes")
+                continue
+            self._record(len(data), time.monotonic() - began)
+            return data
+
+        raise aiohttp.ClientError(f"Segment {start}-{end} failed after {self.max_retries} retries")
+
+    def _record(self, size: int, seconds: float) -> None:
+        """Adjust parallelism once every round of `connections` segments."""
+        self._round_bytes += size
+        self._round_seconds += seconds
+        self._round_segments += 1
+        if self._round_segments < self.connections or not self._round_seconds:
+            return
+
+        # Per-connection throughput times the number of connections in use
+        throughput = self._round_bytes / self._round_seconds * self.connections
+        if throughput > self._last_throughput * 1.1 and self.connections < self.max_connections:
+            self.connections += 1
+        elif throughput < self._last_throughput * 0.9 and self.connections > 1:
+            self.connections -= 1
+        logger.debug(
+            f"Segmented read at {throughput / 1024 / 1024:.1f} MB/s, using {self.connections} connections"
+        )
+        self._last_throughput = throughput
+        self._round_bytes = 0
+        self._round_seconds = 0.0
+        self._round_segments = 0
@@ -0,0 +1,157 @@
+import json
+import pickle
+import zlib
+from typing import Any, Tuple
+
+from aiocache.serializers import BaseSerializer
+
+from utils.logger import logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CompactSerializer(BaseSerializer):
+    """Serializer for cached payloads with a small version header.
+
+    Layout: MAGIC | VERSION | codec | compression | payload
+
+    Values are encoded with msgpack (or JSON when msgpack is not installed) and
+    compressed once they exceed a size threshold. Values those codecs can't
+    represent, including dicts with non-str keys for JSON, fall back to pickle. Data without the header is read as pickle so
+    entries written by the old PickleSerializer stay readable.
+    """
+
+    DEFAULT_ENCODING = None
+
+    MAGIC = b"\xa7"
+    VERSION = b"\x01"
+
+    CODEC_MSGPACK = b"m"
+    CODEC_JSON = b"j"
+    CODEC_PICKLE = b"p"
+
+    COMPRESSION_NONE = b"n"
+    COMPRESSION_ZLIB = b"z"
+    COMPRESSION_ZSTD = b"s"
+
+    def __init__(
+        self,
+        codec: str = "msgpack",
+        compression: str = "zstd",
+        compression_threshold: int = 1024,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if codec == "msgpack" and msgpack is None:
+            logger.warning("msgpack is not installed, caching with JSON instead")
+            codec = "json"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, compressing cache entries with zlib instead")
+            compression = "zlib"
+
+        self.codec = {
+            "msgpack": self.CODEC_MSGPACK,
+            "json": self.CODEC_JSON,
+            "pickle": self.CODEC_PICKLE,
+        }[codec]
+        self.compression = {
+            "zstd": self.COMPRESSION_ZSTD,
+            "zlib": self.COMPRESSION_ZLIB,
+            "none": self.COMPRESSION_NONE,
+        }[compression]
+        self.compression_threshold = compression_threshold
+
+        if zstandard is not None:
+            self._zstd_compressor = zstandard.ZstdCompressor(level=3)
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+
+    def dumps(self, value: Any) -> bytes:
+        return self.dumps_sized(value)[0]
+
+    def loads(self, value: bytes) -> Any:
+        if value is None:
+            return None
+        return self.loads_sized(value)[0]
+
+    def dumps_sized(self, value: Any) -> Tuple[bytes, int]:
+        """dumps() and the payload size before compression, to account for the value in memory."""
+        codec = self.codec
+        try:
+            payload = self._encode(codec, value)
+        except (TypeError, ValueError, OverflowError):
+            codec = self.CODEC_PICKLE
+            payload = self._encode(codec, value)
+
+        size = len(payload)
+        compression = self.COMPRESSION_NONE
+        if self.compression != self.COMPRESSION_NONE and len(payload) >= self.compression_threshold:
+            compression = self.compression
+            payload = self._compress(compression, payload)
+
+        return self.MAGIC + self.VERSION + codec + compression + payload, size
+
+    def loads_sized(self, value: bytes) -> Tuple[Any, int]:
+        """loads() and the payload size after decompression."""
+        if value[:1] != self.MAGIC:
+            # Written by PickleSerializer before the migration
+            return pickle.loads(value), len(value)
+
+        version, codec, compression = value[1:2], value[2:3], value[3:4]
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported cache entry version: {version!r}")
+        payload = self._decompress(compression, value[4:])
+        return self._decode(codec, payload), len(payload)
+
+    def _encode(self, codec: bytes, value: Any) -> bytes:
+        if codec == self.CODEC_MSGPACK:
+            return msgpack.packb(value, use_bin_type=True)
+        if codec == self.CODEC_JSON:
+            self._check_json_keys(value)
+            return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def _check_json_keys(cls, value: Any) -> None:
+        """Raise TypeError for dict keys JSON would silently turn into strings, like season numbers."""
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if not isinstance(key, str):
+                    raise TypeError(f"JSON can't keep {type(key).__name__} dict keys")
+                cls._check_json_keys(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                cls._check_json_keys(item)
+
+    def _decode(self, codec: bytes, payload: bytes) -> Any:
+        if codec == self.CODEC_MSGPACK:
+            return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+        if codec == self.CODEC_JSON:
+            return json.loads(payload)
+        if codec == self.CODEC_PICKLE:
+            return pickle.loads(payload)
+        raise ValueError(f"Unknown cache codec: {codec!r}")
+
+    def _compress(self, compression: bytes, payload: bytes) -> bytes:
+        if compression == self.COMPRESSION_ZSTD:
+            return self._zstd_compressor.compress(payload)
+        return zlib.compress(payload, 6)
+
+    def _decompress(self, compression: bytes, payload: bytes) -> bytes:
+        if compression == self.COMPRESSION_NONE:
+            return payload
+        if compression == self.COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ValueError("Cache entry is zstd compressed but zstandard is not installed")
+            return self._zstd_decompressor.decompress(payload)
+        if compression == self.COMPRESSION_ZLIB:
+            return zlib.decompress(payload)
+        raise ValueError(f"Unknown cache compression: {compression!r}")
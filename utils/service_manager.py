@@ -1,61 +1,133 @@
 import asyncio
-import json
-import os
+import time
 from typing import Dict, List
 
 from services.base import StreamingService
+from utils.cache import set_entry
+from utils.circuit_breaker import get_circuit_breaker
+from utils.config import config
 from utils.logger import logger
+from utils.user_store import user_store
 
 
 class ServiceManager:
     def __init__(self, services: List[StreamingService]):
         self.all_services = services
-        self.users_file = "db/users.json"
+        self._background_tasks = set()
 
     def _get_user_services(self, user: str) -> List[str]:
         """Get list of enabled service names for a user"""
-        if not os.path.exists(self.users_file):
+        user_data = user_store.get(user)
+        if user_data is None:
             return []
-            
-        with open(self.users_file, "r") as f:
-            users = json.load(f)
-            
-        if user not in users:
-            return []
-            
-        return users[user].get("enabled_services", [])
-
-    async def fetch_all_streams(self, meta_id: str, user: str = None) -> List[Dict]:
-        """Fetch streams from all services concurrently."""
-        service_streams_list = await asyncio.gather(
-            *[
-                self._fetch_service_streams(service, meta_id)
-                for service in self.all_services
+
+        return user_data.get("enabled_services", [])
+
+    async def fetch_all_streams(
+        self, meta_id: str, user: str = None, cache_results: bool = False
+    ) -> List[Dict]:
+        """Fetch streams from all services concurrently.
+
+        Returns whatever has arrived once stream_timeout_seconds is reached. Late services
+        keep running in the background and refresh the raw_streams cache when they finish.
+        """
+        tasks = [
+            asyncio.create_task(self._fetch_service_streams(service, meta_id))
+            for service in self.all_services
+        ]
+        _, pending = await asyncio.wait(tasks, timeout=config.stream_timeout_seconds)
+
+        streams = self._process_streams([task.result() for task in tasks if task.done()])
+
+        if cache_results and streams:
+            await self.cache_streams(meta_id, streams)
+
+        if pending:
+            late_services = [
+                service.name
+                for service, task in zip(self.all_services, tasks)
+                if task in pending
             ]
+            logger.info(
+                f"Deadline reached for {meta_id}, returning partial results "
+                f"(still waiting on: {', '.join(late_services)})"
+            )
+            background_task = asyncio.create_task(self._finish_late_services(meta_id, tasks))
+            self._background_tasks.add(background_task)
+            background_task.add_done_callback(self._background_tasks.discard)
+
+        return streams
+
+    async def _finish_late_services(self, meta_id: str, tasks: List[asyncio.Task]) -> None:
+        """Wait for late services and cache the complete result for the next request."""
+        try:
+            service_streams_list = await asyncio.gather(*tasks)
+            streams = self._process_streams(service_streams_list)
+            if streams:
+                await self.cache_streams(meta_id, streams)
+                logger.info(f"Cached complete results for {meta_id} after late services finished")
+        except Exception as e:
+            logger.error(f"Error finishing late services for {meta_id}: {str(e)}")
+
+    async def cache_streams(self, meta_id: str, streams: List[Dict]) -> None:
+        """Store raw streams for a meta_id.
+
+        Error placeholders are never cached. If any service failed, the result is only
+        kept for degraded_cache_ttl_seconds so it is refreshed once the service recovers.
+        """
+        regular_streams = [s for s in streams if s.get("name") != "Error"]
+        if not regular_streams:
+            return
+        ttl = (
+            config.degraded_cache_ttl_seconds
+            if len(regular_streams) != len(streams)
+            else config.cache_ttl_seconds
         )
+        await set_entry(f"raw_streams:{meta_id}", {"streams": regular_streams}, ttl=ttl)
 
-        return self._process_streams(service_streams_list)
+    def _get_service_timeout(self, service: StreamingService) -> float:
+        return (
+            config.get("addon_config", service.name.lower(), "timeout_seconds")
+            or config.service_timeout_seconds
+        )
+
+    def _error_stream(self, service: StreamingService, message: str) -> Dict:
+        return {
+            "name": "Error",
+            "title": f"""❌ {service.name}: {message}""",
+            "url": "https://example.com/",
+            "service": service.name
+        }
 
     async def _fetch_service_streams(
         self, service: StreamingService, meta_id: str
     ) -> List[Dict]:
         """Fetch streams from a single service with error handling."""
+        breaker = get_circuit_breaker(service.name)
+        if not breaker.allow_request():
+            logger.debug(f"Skipping {service.name}, circuit breaker is {breaker.state}")
+            return [self._error_stream(service, "Temporarily unavailable")]
+
+        probe = breaker.is_probing
+        timeout = self._get_service_timeout(service)
+        start_time = time.monotonic()
         try:
-            streams = await service.get_streams(meta_id)
+            streams = await asyncio.wait_for(service.get_streams(meta_id), timeout=timeout)
+            breaker.record_success(time.monotonic() - start_time)
             for stream in streams:
                 stream["service"] = service.name
             return streams
         except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = TimeoutError(f"Timed out after {timeout}s")
+            breaker.record_failure(time.monotonic() - start_time, str(e))
             error_message = f"Error fetching streams from {service.name}:\n{str(e)}"
             logger.error(error_message)
-            return [
-                {
-                    "name": "Error",
-                    "title": f"""❌ {service.name}: {str(e)}""",
-                    "url": "https://example.com/",
-                    "service": service.name
-                }
-            ]
+            return [self._error_stream(service, str(e))]
+        finally:
+            # Cancellation by the overall deadline is a BaseException and skips the handlers above
+            if probe:
+                breaker.release_probe()
 
     def _process_streams(self, service_streams_list: List[List[Dict]]) -> List[Dict]:
         """Process and organize streams from all services."""
@@ -106,3 +178,7 @@ class ServiceManager:
     def get_enabled_services(self) -> List[str]:
         """Get list of enabled service names."""
         return [service.name for service in self.all_services]
+
+    def get_service_health(self) -> List[Dict]:
+        """Get circuit breaker state for every service."""
+        return [get_circuit_breaker(service.name).snapshot() for service in self.all_services]
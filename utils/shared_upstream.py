@@ -0,0 +1,247 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+
+import aiohttp
+
+from utils.buffer_allocator import buffer_allocator
+from utils.logger import logger
+from utils.proxy_metrics import proxy_metrics
+from utils.segment_cache import SegmentWriter
+from utils.segmented_reader import SegmentedReader
+from utils.stream_buffer import StreamBuffer
+
+
+class Subscriber:
+    """One client reading from a SharedUpstream through its own buffer."""
+
+    def __init__(self, offset: int, end: Optional[int], buffer: StreamBuffer):
+        # Absolute position of the next byte to be queued for this client
+        self.offset = offset
+        self.end = end
+        self.buffer = buffer
+        self.detached = False
+
+    @property
+    def done(self) -> bool:
+        return self.end is not None and self.offset > self.end
+
+
+class SharedUpstream:
+    """A single upstream response whose bytes are fanned out to several clients.
+
+    The most recent window_bytes read are kept so clients requesting an offset
+    that was read moments ago can join and start from memory. window_bytes must
+    have been reserved from buffer_allocator, it is released together with the
+    segmented reader's memory when the upstream finishes. The reader only pauses while every client has a full buffer, a
+    client whose buffer is full while others still have room is detached and
+    continues on its own connection.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        response: aiohttp.ClientResponse,
+        start: int,
+        end: Optional[int],
+        size: Optional[int],
+        chunk_size: int,
+        window_bytes: int,
+        resume: Callable[[int, Optional[int], int], Awaitable[Optional[aiohttp.ClientResponse]]],
+        max_retries: int,
+        writer: Optional[SegmentWriter] = None,
+        on_close: Optional[Callable[["SharedUpstream"], None]] = None,
+        segmented: Optional[SegmentedReader] = None,
+    ):
+        self.url = url
+        self.response = response
+        self.start = start
+        self.end = end
+        self.size = size
+        self.content_type = response.headers.get("Content-Type", "video/mp4")
+        self.chunk_size = chunk_size
+        self.window_bytes = window_bytes
+        self.resume = resume
+        self.max_retries = max_retries
+        self.writer = writer
+        self.on_close = on_close
+        self.segmented = segmented
+
+        self.position = start
+        self.completed = False
+        self.finished = False
+        self._subscribers: List[Subscriber] = []
+        self._history = deque()
+        self._history_bytes = 0
+        self._task: Optional[asyncio.Task] = None
+        # Resume attempts since the last byte was read
+        self._failures = 0
+
+    @property
+    def history_start(self) -> int:
+        return self.position - self._history_bytes
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def can_join(self, offset: int, max_lag: int) -> bool:
+        """Whether a client can start at offset, at most max_lag bytes behind the reader."""
+        return (
+            not self.finished
+            and self.size is not None
+            and max(self.history_start, self.position - max_lag) <= offset <= self.position
+        )
+
+    async def subscribe(self, offset: int, end: Optional[int], buffer: StreamBuffer) -> Subscriber:
+        """Attach a client at offset, which must be between history_start and position."""
+        subscriber = Subscriber(offset, end, buffer)
+        for chunk_offset, chunk in self._history:
+            if chunk_offset + len(chunk) > offset and not subscriber.done:
+                buffer.prefill(self._piece(subscriber, chunk_offset, chunk))
+
+        if subscriber.done:
+            await buffer.finish()
+            if self._task is None and not self._subscribers:
+                # Nothing left to read for anyone, the reader is never started
+                self._release_memory(None)
+                await self._close()
+            return subscriber
+
+        self._subscribers.append(subscriber)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            # Also runs if the task is cancelled before it started
+            self._task.add_done_callback(self._release_memory)
+        return subscriber
+
+    async def unsubscribe(self, subscriber: Subscriber) -> None:
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        await subscriber.buffer.close()
+        buffer_allocator.release(subscriber.buffer)
+        if not self._subscribers and self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def _release_memory(self, _task: Optional[asyncio.Task]) -> None:
+        buffer_allocator.unreserve(self.window_bytes)
+        self.window_bytes = 0
+        if self.segmented:
+            self.segmented.release_memory()
+        self._history.clear()
+        self._history_bytes = 0
+
+    async def _run(self) -> None:
+        try:
+            while self._subscribers:
+                chunk = await self._read_chunk()
+                if chunk is None:
+                    break
+                if not chunk:
+                    self.completed = True
+                    break
+                await self._distribute(chunk)
+                if self.writer:
+                    await self.writer.feed(chunk)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self._close()
+
+    async def _close(self) -> None:
+        self.finished = True
+        if self.on_close:
+            self.on_close(self)
+        if self.segmented:
+            await self.segmented.close()
+        for subscriber in self._subscribers:
+            await subscriber.buffer.finish()
+        self.response.release()
+
+    async def _read_chunk(self) -> Optional[bytes]:
+        """Next chunk from upstream, b"" at the end and None if the upstream failed."""
+        if self.segmented:
+            try:
+                return await self.segmented.read()
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                logger.error(f"Segmented read failed at byte {self.position}: {str(e)}")
+                return None
+
+        while True:
+            try:
+                chunk = await self.response.content.read(self.chunk_size)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                logger.warning(f"Upstream read failed at byte {self.position}: {str(e)}")
+                if not await self._reconnect():
+                    return None
+                continue
+            if chunk:
+                # Only progress resets the retries, not a resume that fails again straight away
+                self._failures = 0
+            return chunk
+
+    async def _reconnect(self) -> bool:
+        """Continue from position on a new response, False once max_retries attempts in a row failed."""
+        self.response.release()
+        while self._failures < self.max_retries:
+            self._failures += 1
+            try:
+                resumed = await self.resume(self.position, self.end, self._failures)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                logger.warning(f"Resume attempt {self._failures}/{self.max_retries} failed: {str(e)}")
+                continue
+            if resumed is None:
+                return False
+            proxy_metrics.record_reconnect(self.url)
+            self.response = resumed
+            return True
+
+        logger.error(f"Giving up on upstream after {self.max_retries} failed resume attempts")
+        return False
+
+    async def _distribute(self, chunk: bytes) -> None:
+        offset = self.position
+        self.position += len(chunk)
+        self._history.append((offset, chunk))
+        self._history_bytes += len(chunk)
+        while self._history and self._history_bytes > self.window_bytes:
+            self._history_bytes -= len(self._history.popleft()[1])
+
+        if self._subscribers and not any(s.buffer.has_room(len(chunk)) for s in self._subscribers):
+            await self._wait_for_room()
+
+        for subscriber in list(self._subscribers):
+            if subscriber.offset >= self.position:
+                # Joined while waiting and already got this chunk from the history
+                continue
+            buffer = subscriber.buffer
+            if len(self._subscribers) > 1 and not buffer.has_room(len(chunk)):
+                # Too far behind the others, it continues on its own connection
+                logger.info(f"Detaching slow reader from shared upstream at byte {subscriber.offset}")
+                subscriber.detached = True
+                self._subscribers.remove(subscriber)
+                await buffer.finish()
+                continue
+
+            await buffer.put(self._piece(subscriber, offset, chunk), block=False)
+            if subscriber.done:
+                self._subscribers.remove(subscriber)
+                await buffer.finish()
+
+    def _piece(self, subscriber: Subscriber, offset: int, chunk: bytes) -> bytes:
+        """Return the part of chunk (read at offset) the subscriber still needs and advance it."""
+        start = subscriber.offset - offset
+        stop = len(chunk)
+        if subscriber.end is not None:
+            stop = min(stop, subscriber.end + 1 - offset)
+        piece = chunk if (start, stop) == (0, len(chunk)) else chunk[start:stop]
+        subscriber.offset += len(piece)
+        return piece
+
+    async def _wait_for_room(self) -> None:
+        waiters = [asyncio.create_task(s.buffer.wait_for_room()) for s in self._subscribers]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
@@ -0,0 +1,116 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.logger import logger
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single in-flight call.
+
+    The first caller starts the work as a task, later callers await the same task.
+    The task is shielded so a disconnecting leader does not cancel it for everyone else.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    async def do(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        check: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, func, check))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            logger.debug(f"Joining in-flight call for {key}")
+        return await asyncio.shield(task)
+
+    async def _run(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        check: Optional[Callable[[], Awaitable[Any]]],
+    ) -> Any:
+        return await func()
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Avoid "exception was never retrieved" warnings when every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+
+class RedisSingleFlight(SingleFlight):
+    """SingleFlight that also coalesces across workers and replicas with a Redis lock.
+
+    The worker holding the lock runs the call. Other workers poll `check` (usually a
+    cache read) until the result shows up, and run the call themselves if the lock
+    expires or is released without a result.
+    """
+
+    RELEASE_SCRIPT = (
+        "if redis.call('get',KEYS[1]) == ARGV[1] then"
+        " return redis.call('del',KEYS[1])"
+        " else"
+        " return 0"
+        " end"
+    )
+
+    def __init__(self, cache, lock_timeout: float = 30, poll_interval: float = 0.2):
+        super().__init__()
+        self.cache = cache
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    async def _run(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        check: Optional[Callable[[], Awaitable[Any]]],
+    ) -> Any:
+        lock_key = self.cache.build_key(f"lock:{key}")
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+
+        while time.monotonic() < deadline:
+            try:
+                acquired = await self.cache.raw(
+                    "set", lock_key, token, nx=True, px=int(self.lock_timeout * 1000)
+                )
+            except Exception as e:
+                logger.error(f"Error acquiring lock for {key}: {str(e)}")
+                break
+
+            if acquired:
+                try:
+                    # Another worker may have finished between our cache miss and the lock
+                    if check:
+                        result = await check()
+                        if result is not None:
+                            return result
+                    return await func()
+                finally:
+                    try:
+                        await self.cache.raw("eval", self.RELEASE_SCRIPT, 1, lock_key, token)
+                    except Exception as e:
+                        logger.error(f"Error releasing lock for {key}: {str(e)}")
+
+            if check:
+                result = await check()
+                if result is not None:
+                    logger.debug(f"Result for {key} was fetched by another worker")
+                    return result
+            await asyncio.sleep(self.poll_interval)
+
+        logger.warning(f"Gave up waiting for another worker on {key}")
+        return await func()
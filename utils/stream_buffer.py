@@ -0,0 +1,88 @@
+import asyncio
+from collections import deque
+from typing import Optional
+
+
+class StreamBuffer:
+    """Bounded async byte queue between an upstream reader and a client writer.
+
+    put() blocks once max_bytes are buffered and resumes when the reader has drained
+    the buffer to low_watermark, so the producer doesn't wake for every chunk.
+    get() wakes as soon as data arrives and returns None once the producer has
+    finished and everything has been read.
+    """
+
+    def __init__(self, max_bytes: int, low_watermark_ratio: float = 0.2):
+        self.low_watermark_ratio = low_watermark_ratio
+        self.resize(max_bytes)
+        self.size = 0
+        self._chunks = deque()
+        self._finished = False
+        self._closed = False
+        self._condition = asyncio.Condition()
+
+    def resize(self, max_bytes: int) -> None:
+        """Change the byte limit, a smaller limit applies once the reader drains below it."""
+        self.max_bytes = max_bytes
+        self.low_watermark = int(max_bytes * self.low_watermark_ratio)
+
+    def has_room(self, size: int) -> bool:
+        # An empty buffer always accepts a chunk so oversized chunks can't deadlock
+        return not self.size or self.size + size <= self.max_bytes
+
+    async def wait_for_room(self) -> None:
+        """Wait until the reader has drained the buffer to low_watermark."""
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self._closed or self.size <= self.low_watermark
+            )
+
+    def prefill(self, chunk: bytes) -> None:
+        """Queue a chunk without waiting, only for use before the reader starts."""
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+
+    async def put(self, chunk: bytes, block: bool = True) -> bool:
+        """Queue a chunk, returns False if the reader has gone away.
+
+        With block=False the chunk is queued even if the buffer is over its limit.
+        """
+        async with self._condition:
+            if block and not self.has_room(len(chunk)):
+                await self._condition.wait_for(
+                    lambda: self._closed or self.size <= self.low_watermark
+                )
+            if self._closed:
+                return False
+            self._chunks.append(chunk)
+            self.size += len(chunk)
+            self._condition.notify_all()
+            return True
+
+    async def get(self) -> Optional[bytes]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._chunks or self._finished)
+            if not self._chunks:
+                return None
+            chunk = self._chunks.popleft()
+            self.size -= len(chunk)
+            # Not only when crossing low_watermark: resize() may have raised it above
+            # the buffered size while the producer was already waiting
+            if self.size <= self.low_watermark:
+                self._condition.notify_all()
+            return chunk
+
+    async def finish(self) -> None:
+        """Mark the end of the stream, readers get the remaining chunks and then None."""
+        async with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    async def close(self) -> None:
+        """Drop buffered data and release a blocked producer."""
+        async with self._condition:
+            self._closed = True
+            self._finished = True
+            self._chunks.clear()
+            self.size = 0
+            self._condition.notify_all()
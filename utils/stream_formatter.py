@@ -1,67 +1,204 @@
-from typing import List, Dict, Any
-from utils.config import config
+from collections.abc import MutableMapping
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Dict, Any, FrozenSet, Iterator, Optional, Tuple
 from utils.url_processor import URLProcessor
 from utils.video_info import VideoInfoParser
-import copy
+
+
+class StreamView(MutableMapping):
+    """Copy-on-write view of a cached stream.
+
+    Reads fall through to the cached stream, writes and deletions are kept in the
+    view, so the cached stream that other requests share is never modified.
+    Nested values such as behaviorHints are shared and must not be changed in place.
+    """
+
+    __slots__ = ("_base", "_overrides", "_deleted")
+
+    def __init__(self, base: Dict[str, Any]):
+        self._base = base
+        self._overrides: Dict[str, Any] = {}
+        self._deleted = set()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._overrides:
+            return self._overrides[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        return self._base[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._overrides[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._overrides.pop(key, None)
+        if key in self._base:
+            self._deleted.add(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._overrides or (key in self._base and key not in self._deleted)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self._base:
+            if key not in self._deleted:
+                yield key
+        for key in self._overrides:
+            if key not in self._base:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+@dataclass(frozen=True)
+class StreamPlan:
+    """User settings compiled into the steps applied to each stream."""
+    enabled_services: FrozenSet[str] = frozenset()
+    cached_only: bool = False
+    one_per_quality: bool = False
+    simple_format: bool = False
+    vidi_mode: bool = False
+
+    @property
+    def needs_parse(self) -> bool:
+        return self.one_per_quality or self.simple_format
+
+    @property
+    def formats(self) -> bool:
+        return self.simple_format or self.vidi_mode
+
+
+@lru_cache(maxsize=256)
+def _compile_plan(enabled_services: Tuple[str, ...], cached_only: bool, one_per_quality: bool,
+                  simple_format: bool, vidi_mode: bool) -> StreamPlan:
+    return StreamPlan(frozenset(enabled_services), cached_only, one_per_quality, simple_format, vidi_mode)
+
+
+def get_stream_plan(user_data: Optional[Dict[str, Any]]) -> StreamPlan:
+    """Return the plan for a user's settings, users with the same settings share one plan."""
+    if not user_data:
+        return _compile_plan((), False, False, False, False)
+    return _compile_plan(
+        tuple(sorted(user_data.get("enabled_services") or [])),
+        bool(user_data.get("cached_only", False)),
+        bool(user_data.get("one_per_quality", False)),
+        bool(user_data.get("simple_format", False)),
+        bool(user_data.get("vidi_mode", False)),
+    )
+
 
 class StreamFormatter:
     def __init__(self, url_processor: URLProcessor):
         self.url_processor = url_processor
         self.video_parser = VideoInfoParser()
 
-    async def process_streams(self, streams: List[Dict[str, Any]], user_path: str, proxy_streams: bool, meta_id: str, username: str = None) -> List[Dict[str, Any]]:
-        """Process streams with URL processing and formatting."""
+    async def process_streams(self, streams: List[Dict[str, Any]], user_path: str, proxy_streams: bool, meta_id: str, user_data: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Process streams with URL processing and formatting.
+
+        Streams are filtered and ranked on the cached data first, so only the
+        streams that are returned get formatted and their URLs processed. Changes
+        are made on StreamViews, which FastAPI serializes like dicts.
+        """
         if not streams:
             return []
 
+        plan = get_stream_plan(user_data)
         regular_streams = [s for s in streams if s.get("name") != "Error"]
-        streams_to_return = {"streams": copy.deepcopy(regular_streams)}
-        
+        watchhub_streams, selected_streams = self.select_streams(regular_streams, plan)
+
+        streams_to_return = [StreamView(stream) for stream in watchhub_streams]
+        for stream, info in selected_streams:
+            stream = StreamView(stream)
+            if plan.formats:
+                self._format_stream(stream, info, plan)
+            streams_to_return.append(stream)
+
         await self.url_processor.process_stream_urls(
-            streams_to_return["streams"], 
-            user_path, 
-            proxy_streams, 
+            streams_to_return,
+            user_path,
+            proxy_streams,
             meta_id=meta_id
         )
-        
-        self._process_stream_formatting(streams_to_return["streams"], username)
-        
-        return streams_to_return["streams"]
-
-    def filter_streams_by_services(self, streams: List[Dict[str, Any]], enabled_services: List[str]) -> List[Dict[str, Any]]:
-        if not enabled_services:
-            return streams
-            
-        return [s for s in streams if s.get("service") in enabled_services]
-
-    def vidi_format(self, streams: List[Dict[str, Any]], username: str = None) -> None:
-        for stream in streams:
-            stream_name = stream.get('name', stream['service'])
-            stream_name = ' '.join(stream_name.split())
-            
-            if 'title' in stream and stream['title']:
-                stream['title'] = f"{stream_name}\n{stream['title']}"
-            elif 'description' in stream and stream['description']:
-                stream['description'] = f"{stream_name}\n{stream['description'].lstrip()}"
-            else:
-                stream['description'] = stream_name
-
-    def simple_format(self, streams: List[Dict[str, Any]], username: str = None) -> None:
+        return streams_to_return
+
+    def select_streams(
+        self, streams: List[Dict[str, Any]], plan: StreamPlan
+    ) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]]:
+        """Filter and rank streams in a single pass without modifying them.
+
+        Returns the WatchHub streams, which are never filtered by cache status,
+        ranked or reformatted, and the other kept streams in output order with
+        their parsed info. Each stream is parsed at most once.
+        """
+        watchhub_streams = []
+        kept_streams = []
+        best_by_resolution = {}
+
         for stream in streams:
-            info = self.video_parser.parse(stream)
-            formatted_info = info['formatted_description']
-            
-            stream['name'] = stream.get('service', 'Unknown')
-
-            if 'title' in stream and stream['title']:
-                stream['title'] = formatted_info
-            elif 'description' in stream and stream['description']:
-                stream['description'] = formatted_info
-            else:
-                stream['description'] = formatted_info
-
-    def one_per_quality(self, streams: List[Dict[str, Any]], username: str = None) -> None:
-        """Filter streams to keep only the best quality stream for each resolution.
+            service = stream.get("service")
+            if plan.enabled_services and service not in plan.enabled_services:
+                continue
+            if service == "WatchHub":
+                watchhub_streams.append(stream)
+                continue
+            if plan.cached_only and not stream.get("is_cached", False):
+                continue
+
+            info = self.video_parser.parse(stream) if plan.needs_parse else None
+
+            if plan.one_per_quality:
+                resolution = info['raw_info']['resolution']
+                rank = self._quality_rank(stream, info['raw_info'])
+                best = best_by_resolution.get(resolution)
+                # Strictly greater keeps the first of equally ranked streams
+                if best is None or rank > best[0]:
+                    best_by_resolution[resolution] = (rank, stream, info)
+                continue
+
+            kept_streams.append((stream, info))
+
+        if plan.one_per_quality:
+            for resolution in self._sort_resolutions(best_by_resolution):
+                _, stream, info = best_by_resolution[resolution]
+                kept_streams.append((stream, info))
+
+        return watchhub_streams, kept_streams
+
+    def _format_stream(self, stream: MutableMapping, info: Optional[Dict[str, Any]], plan: StreamPlan) -> None:
+        if plan.simple_format:
+            self._simple_format_stream(stream, info)
+        if plan.vidi_mode:
+            self._vidi_format_stream(stream)
+
+    def _vidi_format_stream(self, stream: MutableMapping) -> None:
+        stream_name = stream.get('name', stream['service'])
+        stream_name = ' '.join(stream_name.split())
+
+        if 'title' in stream and stream['title']:
+            stream['title'] = f"{stream_name}\n{stream['title']}"
+        elif 'description' in stream and stream['description']:
+            stream['description'] = f"{stream_name}\n{stream['description'].lstrip()}"
+        else:
+            stream['description'] = stream_name
+
+    def _simple_format_stream(self, stream: MutableMapping, info: Dict[str, Any]) -> None:
+        formatted_info = info['formatted_description']
+
+        stream['name'] = stream.get('service', 'Unknown')
+
+        if 'title' in stream and stream['title']:
+            stream['title'] = formatted_info
+        elif 'description' in stream and stream['description']:
+            stream['description'] = formatted_info
+        else:
+            stream['description'] = formatted_info
+
+    def _quality_rank(self, stream: Dict[str, Any], raw_info: Dict[str, Any]) -> tuple:
+        """Rank used to pick the best stream for each resolution.
         The best quality is determined by:
         0. Cache status (cached streams preferred)
         1. HDR presence (DV > HDR10+ > HDR10 > HDR > None)
@@ -69,68 +206,24 @@ class StreamFormatter:
         3. Audio quality (Atmos > TrueHD > DTS-HD > DTS > DD+ > DD > AAC > MP3)
         4. File size (larger is assumed better quality)
         """
-        if not streams:
-            return
-
-        # Group streams by resolution
-        resolution_groups = {}
-        for stream in streams:
-            info = self.video_parser.parse(stream)
-            resolution = info['raw_info']['resolution']
-            if resolution not in resolution_groups:
-                resolution_groups[resolution] = []
-            resolution_groups[resolution].append((stream, info['raw_info']))
+        size = raw_info['size'].split()[0] if raw_info['size'] else ''
+        return (
+            # Cache status
+            1000 if (stream.get('cached', False) or raw_info['is_cached']) else 0,
+            # HDR
+            max([self.video_parser.HDR_PRIORITY.get(hdr, 0) for hdr in raw_info['hdr']]) if raw_info['hdr'] else 0,
+            # Codec
+            self.video_parser.CODEC_PRIORITY.get(raw_info['codec'].split()[0], 0),
+            # Audio
+            max([self.video_parser.AUDIO_PRIORITY.get(audio.split()[0], 0) for audio in raw_info['audio']]) if raw_info['audio'] else 0,
+            # Size (convert to bytes for comparison)
+            float(size) if size and size.replace('.', '').isdigit() else 0
+        )
 
+    def _sort_resolutions(self, resolutions) -> List[str]:
         # Sort resolutions by quality (8K > 4K > 1080p > 720p > 480p > 360p > Unknown)
-        sorted_resolutions = sorted(
-            resolution_groups.keys(),
+        return sorted(
+            resolutions,
             key=lambda x: self.video_parser.RESOLUTION_PRIORITY.get(x, -1) if x != 'Unknown' else -999,
             reverse=True
         )
-
-        # For each resolution, find the best quality stream
-        best_streams = []
-        for resolution in sorted_resolutions:
-            stream_infos = resolution_groups[resolution]
-
-            sorted_streams = sorted(stream_infos, key=lambda x: (
-                # Cache status
-                1000 if (x[0].get('cached', False) or x[1]['is_cached']) else 0,
-                # HDR
-                max([self.video_parser.HDR_PRIORITY.get(hdr, 0) for hdr in x[1]['hdr']]) if x[1]['hdr'] else 0,
-                # Codec
-                self.video_parser.CODEC_PRIORITY.get(x[1]['codec'].split()[0], 0),
-                # Audio
-                max([self.video_parser.AUDIO_PRIORITY.get(audio.split()[0], 0) for audio in x[1]['audio']]) if x[1]['audio'] else 0,
-                # Size (convert to bytes for comparison)
-                float(x[1]['size'].split()[0]) if x[1]['size'] and x[1]['size'].split()[0].replace('.', '').isdigit() else 0
-            ), reverse=True)
-
-            if sorted_streams:
-                best_streams.append(sorted_streams[0][0])
-
-        streams[:] = best_streams
-
-    def _process_stream_formatting(self, streams: List[Dict[str, Any]], username: str = None) -> None:
-        cached_only = config.get_user_cached_only(username) if username else False
-        one_per_quality = config.get_user_one_per_quality(username) if username else False
-        simple_mode = config.get_user_simple_format(username) if username else False
-        vidi_mode = config.get_user_vidi_mode(username) if username else False
-
-        if not streams:
-            return
-
-        watchhub_streams = [s for s in streams if s.get("service") == "WatchHub"]
-        filtered_streams = [s for s in streams if s.get("service") != "WatchHub"]
-
-        if filtered_streams:
-            if cached_only:
-                filtered_streams = [s for s in filtered_streams if s.get("is_cached", False)]
-            if one_per_quality:
-                self.one_per_quality(filtered_streams, username)
-            if simple_mode:
-                self.simple_format(filtered_streams, username)
-            if vidi_mode:
-                self.vidi_format(filtered_streams, username)
-
-        streams[:] = watchhub_streams + filtered_streams
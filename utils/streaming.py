@@ -1,13 +1,22 @@
 import asyncio
-import io
-from collections import deque
-from typing import AsyncGenerator, Dict
+import time
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
 
 import aiohttp
-from fastapi.responses import StreamingResponse
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask, BackgroundTasks
 
+from utils.bandwidth import BandwidthSession, bandwidth_scheduler
+from utils.buffer_allocator import buffer_allocator
 from utils.config import config
 from utils.logger import logger
+from utils.proxy_client import proxy_client
+from utils.proxy_metrics import ProxySession, proxy_metrics
+from utils.segment_cache import SegmentWriter, segment_cache
+from utils.segmented_reader import SegmentedReader
+from utils.shared_upstream import SharedUpstream, Subscriber
+from utils.stream_buffer import StreamBuffer
 
 
 class StreamManager:
@@ -23,95 +32,496 @@ class StreamManager:
             "Accept": "*/*",
             "Connection": "keep-alive",
         }
+        # Upstream responses currently being read, by URL, that new requests can join
+        self._shared_upstreams: Dict[str, List[SharedUpstream]] = {}
 
     async def create_streaming_response(
-        self, url: str, request_headers: Dict
+        self, url: str, request_headers: Dict, username: Optional[str] = None
     ) -> StreamingResponse:
-        headers = self.default_headers.copy()
-        if "range" in request_headers:
-            headers["range"] = request_headers["range"]
+        bandwidth = self._open_bandwidth_session(username)
+        metrics = proxy_metrics.start_session(username, url)
+        try:
+            response = await self._open_response(url, request_headers, metrics)
+        except BaseException:
+            proxy_metrics.end_session(metrics)
+            bandwidth_scheduler.close_session(bandwidth)
+            raise
+
+        response.body_iterator = self._track(response.body_iterator, metrics)
+        if bandwidth_scheduler.enabled:
+            response.body_iterator = self._throttle(response.body_iterator, bandwidth)
+        # Covers clients that disconnect before the body is iterated
+        background = BackgroundTasks([response.background] if response.background else [])
+        background.add_task(proxy_metrics.end_session, metrics)
+        background.add_task(bandwidth_scheduler.close_session, bandwidth)
+        response.background = background
+        return response
+
+    async def _open_response(
+        self, url: str, request_headers: Dict, metrics: ProxySession
+    ) -> StreamingResponse:
+        headers = self._upstream_headers(request_headers)
+
+        if segment_cache.enabled:
+            cached_response = self._create_cached_response(url, request_headers)
+            if cached_response is not None:
+                metrics.source = "cache"
+                return cached_response
+
+        buffer = self._acquire_buffer()
+        metrics.buffer = buffer
+
+        shared_response = await self._join_shared_upstream(url, request_headers, buffer, metrics)
+        if shared_response is not None:
+            return shared_response
+
+        # The response that provides the headers is the one whose body gets streamed,
+        # so every play or seek costs a single upstream request
+        try:
+            response = await proxy_client.session.get(url, headers=headers)
+        except BaseException:
+            buffer_allocator.release(buffer)
+            raise
 
-        timeout = aiohttp.ClientTimeout(total=180)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url, headers=headers) as response:
-                content_range = response.headers.get("Content-Range", "")
-                content_length = response.headers.get("Content-Length", "")
-                
-                response_headers = {
-                    "Accept-Ranges": "bytes",
-                    "Content-Range": content_range if content_range else None,
-                    "Content-Length": content_length if content_length else None,
-                    "Connection": "keep-alive",
-                    "Cache-Control": "no-cache",
-                }
-                response_headers = {k: v for k, v in response_headers.items() if v is not None}
-                media_type = response.headers.get("Content-Type", "video/mp4")
+        if response.status >= 400:
+            self._release(response, buffer)
+            raise HTTPException(
+                status_code=502, detail=f"Upstream returned {response.status}"
+            )
+
+        upstream = self._share_upstream(url, headers, response)
+        subscriber = await upstream.subscribe(upstream.start, upstream.end, buffer)
 
         return StreamingResponse(
-            self._stream_content(url, headers),
-            media_type=media_type,
+            self._stream_shared(upstream, subscriber),
+            media_type=upstream.content_type,
+            status_code=206 if "range" in request_headers else 200,
+            headers=self._response_headers(response),
+            # Covers clients that disconnect before the body is iterated
+            background=BackgroundTask(upstream.unsubscribe, subscriber),
+        )
+
+    async def create_head_response(self, url: str, request_headers: Dict) -> Response:
+        """Answer HEAD requests from the upstream headers without fetching the body."""
+        headers = self._upstream_headers(request_headers)
+
+        if segment_cache.enabled:
+            cached_response = self._create_cached_response(url, request_headers, head=True)
+            if cached_response is not None:
+                return cached_response
+
+        session = proxy_client.session
+        async with session.head(url, headers=headers, allow_redirects=True) as response:
+            if response.status not in (405, 501):
+                return self._head_response(response, request_headers)
+
+        # Upstream doesn't support HEAD, read the headers of a GET and drop the body
+        async with session.get(url, headers=headers) as response:
+            return self._head_response(response, request_headers)
+
+    def _head_response(self, response: aiohttp.ClientResponse, request_headers: Dict) -> Response:
+        if response.status >= 400:
+            raise HTTPException(
+                status_code=502, detail=f"Upstream returned {response.status}"
+            )
+        return Response(
             status_code=206 if "range" in request_headers else 200,
-            headers=response_headers,
+            headers=self._response_headers(response),
+            media_type=response.headers.get("Content-Type", "video/mp4"),
+        )
+
+    def _create_cached_response(
+        self, url: str, request_headers: Dict, head: bool = False
+    ) -> Optional[Response]:
+        """Serve a request from the segment cache when its first block is cached."""
+        key = segment_cache.resource_key(url)
+        metadata = segment_cache.get_metadata(key)
+        if metadata is None:
+            return None
+
+        size = metadata["size"]
+        if "range" in request_headers:
+            requested = self._parse_range(request_headers["range"])
+            if requested is None:
+                return None
+            start, end = requested
+            end = size - 1 if end is None else min(end, size - 1)
+        else:
+            start, end = 0, size - 1
+        if start > end:
+            return None
+
+        headers = self._local_headers(start, end, size, "range" in request_headers)
+        status_code = 206 if "range" in request_headers else 200
+
+        if head:
+            return Response(status_code=status_code, headers=headers, media_type=metadata["content_type"])
+        if not segment_cache.has_block(key, start // segment_cache.block_size):
+            return None
+
+        logger.debug(f"Segment cache hit for bytes {start}-{end} of {key}")
+        return StreamingResponse(
+            self._stream_cached(url, key, start, end),
+            media_type=metadata["content_type"],
+            status_code=status_code,
+            headers=headers,
+        )
+
+    async def _stream_cached(
+        self, url: str, key: str, start: int, end: int
+    ) -> AsyncGenerator[bytes, None]:
+        """Yield cached blocks and continue from upstream at the first missing block."""
+        offset = start
+        block_size = segment_cache.block_size
+        while offset <= end:
+            index = offset // block_size
+            block = await segment_cache.read_block(key, index)
+            if not block:
+                break
+            block_start = index * block_size
+            if offset == block_start and end >= block_start + len(block) - 1:
+                piece = block
+            else:
+                piece = block[offset - block_start:end + 1 - block_start]
+            if not piece:
+                break
+            yield piece
+            offset += len(piece)
+
+        if offset > end:
+            return
+
+        logger.debug(f"Segment cache miss at byte {offset} of {key}, continuing from upstream")
+        content = self._stream_range(url, offset, end)
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            await content.aclose()
+
+    async def _track(
+        self, content: AsyncGenerator[bytes, None], metrics: ProxySession
+    ) -> AsyncGenerator[bytes, None]:
+        """Record time to first byte, bytes sent and stalls of a response."""
+        try:
+            waiting_since = time.monotonic()
+            async for chunk in content:
+                proxy_metrics.record_chunk(metrics, len(chunk), time.monotonic() - waiting_since)
+                yield chunk
+                waiting_since = time.monotonic()
+        finally:
+            proxy_metrics.end_session(metrics)
+            await content.aclose()
+
+    async def _throttle(
+        self, content: AsyncGenerator[bytes, None], session: BandwidthSession
+    ) -> AsyncGenerator[bytes, None]:
+        """Pace a response to this stream's share of the proxy bandwidth."""
+        try:
+            async for chunk in content:
+                await bandwidth_scheduler.throttle(session, len(chunk))
+                yield chunk
+        finally:
+            bandwidth_scheduler.close_session(session)
+            await content.aclose()
+
+    async def _join_shared_upstream(
+        self, url: str, request_headers: Dict, buffer: StreamBuffer, metrics: ProxySession
+    ) -> Optional[StreamingResponse]:
+        """Serve a request from an upstream response another client is already reading.
+
+        Only joins where the backfill from the upstream's history fills at most half
+        of buffer, a full buffer would get the new reader detached right away.
+        """
+        upstreams = self._shared_upstreams.get(url)
+        if not upstreams:
+            return None
+
+        if "range" in request_headers:
+            requested = self._parse_range(request_headers["range"])
+            if requested is None:
+                return None
+        else:
+            requested = (0, None)
+        start, end = requested
+
+        for upstream in upstreams:
+            if not upstream.can_join(start, buffer.max_bytes // 2):
+                continue
+            end = upstream.size - 1 if end is None else min(end, upstream.size - 1)
+            if start > end:
+                return None
+
+            subscriber = await upstream.subscribe(start, end, buffer)
+            metrics.source = "shared"
+            logger.info(f"Joined shared upstream at byte {start} ({upstream.subscribers} readers)")
+            return StreamingResponse(
+                self._stream_shared(upstream, subscriber),
+                media_type=upstream.content_type,
+                status_code=206 if "range" in request_headers else 200,
+                headers=self._local_headers(start, end, upstream.size, "range" in request_headers),
+                background=BackgroundTask(upstream.unsubscribe, subscriber),
+            )
+        return None
+
+    def _share_upstream(
+        self,
+        url: str,
+        headers: Dict,
+        response: aiohttp.ClientResponse,
+    ) -> SharedUpstream:
+        start, end, size = self._content_range(response)
+        validator = self._resume_validator(response)
+
+        async def resume(
+            offset: int, end: Optional[int], attempt: int
+        ) -> Optional[aiohttp.ClientResponse]:
+            return await self._resume(url, headers, offset, end, validator, attempt)
+
+        segmented = None
+        if config.proxy_parallel_connections > 1 and end is not None:
+            segmented = SegmentedReader(
+                proxy_client.session,
+                url,
+                headers,
+                response,
+                start,
+                end,
+                self.chunk_size,
+                config.proxy_parallel_connections,
+                config.proxy_max_retries,
+                validator,
+            )
+
+        upstream = SharedUpstream(
+            url,
+            response,
+            start,
+            end,
+            size,
+            self.chunk_size,
+            # The history window counts against the proxy memory budget like the buffers
+            buffer_allocator.reserve(config.proxy_shared_window_mb * 1024 * 1024),
+            resume,
+            config.proxy_max_retries,
+            writer=self._segment_writer(url, response),
+            on_close=self._forget_upstream,
+            segmented=segmented,
         )
+        self._shared_upstreams.setdefault(url, []).append(upstream)
+        return upstream
+
+    def _forget_upstream(self, upstream: SharedUpstream) -> None:
+        upstreams = self._shared_upstreams.get(upstream.url, [])
+        if upstream in upstreams:
+            upstreams.remove(upstream)
+        if not upstreams:
+            self._shared_upstreams.pop(upstream.url, None)
+
+    async def _stream_shared(
+        self, upstream: SharedUpstream, subscriber: Subscriber
+    ) -> AsyncGenerator[bytes, None]:
+        try:
+            while True:
+                chunk = await subscriber.buffer.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await upstream.unsubscribe(subscriber)
 
-    async def _stream_content(
-        self, url: str, headers: Dict
+        # Continue on a connection of our own when we fell behind the other readers,
+        # or when the shared response ended before the range this client asked for
+        if subscriber.detached or (
+            upstream.completed and subscriber.end is not None and not subscriber.done
+        ):
+            content = self._stream_range(upstream.url, subscriber.offset, subscriber.end)
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                await content.aclose()
+
+    async def _stream_range(
+        self, url: str, offset: int, end: Optional[int]
     ) -> AsyncGenerator[bytes, None]:
-        timeout = aiohttp.ClientTimeout(total=None, connect=120, sock_read=120)
-        buffer = deque()
-        current_buffer_size = 0
-        buffer_low_threshold = self.buffer_size * 0.2  # 20% of buffer size
-
-        connector = aiohttp.TCPConnector(
-            limit=0,
-            ttl_dns_cache=300,
-            force_close=False,
-            enable_cleanup_closed=True,
+        """Stream bytes offset-end from a new upstream request, used to continue a response."""
+        buffer = buffer_allocator.acquire(self.buffer_size)
+        if buffer is None:
+            logger.warning("Proxy buffer budget exhausted, ending stream early")
+            return
+
+        headers = self._upstream_headers({"range": f"bytes={offset}-{'' if end is None else end}"})
+        try:
+            response = await proxy_client.session.get(url, headers=headers)
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            logger.error(f"Upstream request failed at byte {offset}: {str(e)}")
+            buffer_allocator.release(buffer)
+            return
+
+        if response.status != 206 or self._content_range(response)[0] != offset:
+            logger.error(f"Upstream can't serve byte {offset} (status {response.status})")
+            self._release(response, buffer)
+            return
+
+        upstream = self._share_upstream(url, headers, response)
+        subscriber = await upstream.subscribe(offset, end, buffer)
+        content = self._stream_shared(upstream, subscriber)
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            await content.aclose()
+            await upstream.unsubscribe(subscriber)
+
+    def _segment_writer(
+        self, url: str, response: aiohttp.ClientResponse
+    ) -> Optional[SegmentWriter]:
+        """Record the file's metadata and return a writer that caches the streamed blocks."""
+        if not segment_cache.enabled:
+            return None
+        start, _, size = self._content_range(response)
+        if size is None:
+            return None
+
+        key = segment_cache.resource_key(url)
+        segment_cache.set_metadata(
+            key,
+            size,
+            response.headers.get("Content-Type", "video/mp4"),
+            self._resume_validator(response),
         )
+        return segment_cache.writer(key, start)
+
+    def _open_bandwidth_session(self, username: Optional[str]) -> BandwidthSession:
+        session = bandwidth_scheduler.open_session(username)
+        if session is None:
+            proxy_metrics.record_rejected()
+            raise HTTPException(
+                status_code=503,
+                detail="Proxy bandwidth is fully used, try again shortly",
+                headers={"Retry-After": "10"},
+            )
+        return session
+
+    def _acquire_buffer(self) -> StreamBuffer:
+        buffer = buffer_allocator.acquire(self.buffer_size)
+        if buffer is None:
+            proxy_metrics.record_rejected()
+            raise HTTPException(
+                status_code=503,
+                detail="Proxy is at capacity, try again shortly",
+                headers={"Retry-After": "10"},
+            )
+        return buffer
+
+    @staticmethod
+    def _local_headers(start: int, end: int, size: int, ranged: bool) -> Dict:
+        """Response headers for bytes start-end of a file whose size is known."""
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(end - start + 1),
+            "Connection": "keep-alive",
+            "Cache-Control": "no-cache",
+        }
+        if ranged:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return headers
+
+    def _upstream_headers(self, request_headers: Dict) -> Dict:
+        headers = self.default_headers.copy()
+        if "range" in request_headers:
+            headers["range"] = request_headers["range"]
+        return headers
+
+    def _response_headers(self, response: aiohttp.ClientResponse) -> Dict:
+        content_range = response.headers.get("Content-Range", "")
+        content_length = response.headers.get("Content-Length", "")
+
+        response_headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Range": content_range if content_range else None,
+            "Content-Length": content_length if content_length else None,
+            "Connection": "keep-alive",
+            "Cache-Control": "no-cache",
+        }
+        return {k: v for k, v in response_headers.items() if v is not None}
+
+    @staticmethod
+    def _release(
+        response: aiohttp.ClientResponse, buffer: Optional[StreamBuffer] = None
+    ) -> None:
+        if buffer is not None:
+            buffer_allocator.release(buffer)
+        response.release()
+
+    async def _resume(
+        self,
+        url: str,
+        headers: Dict,
+        offset: int,
+        end: Optional[int],
+        validator: Optional[str],
+        attempt: int,
+    ) -> Optional[aiohttp.ClientResponse]:
+        """Reconnect to the upstream from offset after a backoff that grows with attempt.
+
+        Raises the client error when the request fails, returns None when the
+        upstream can't continue the same file from that position.
+        """
+        resume_headers = headers.copy()
+        resume_headers["range"] = f"bytes={offset}-{'' if end is None else end}"
+        if validator:
+            # Makes the upstream send the whole file instead if it has changed
+            resume_headers["If-Range"] = validator
+
+        await asyncio.sleep(min(0.5 * 2 ** (attempt - 1), 8))
+        response = await proxy_client.session.get(url, headers=resume_headers)
+
+        content_range = response.headers.get("Content-Range", "")
+        if response.status == 206 and content_range.startswith(f"bytes {offset}-"):
+            logger.info(f"Resumed upstream stream at byte {offset}")
+            return response
+
+        response.release()
+        logger.error(
+            f"Upstream can't resume at byte {offset} (status {response.status}), ending stream"
+        )
+        return None
+
+    @staticmethod
+    def _parse_range(range_header: str) -> Optional[Tuple[int, Optional[int]]]:
+        """bytes=100-200 -> (100, 200), bytes=100- -> (100, None), suffix and multiple ranges -> None"""
+        if not range_header.startswith("bytes=") or "," in range_header:
+            return None
+        start, _, end = range_header[6:].strip().partition("-")
+        try:
+            return int(start), int(end) if end else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _content_range(
+        response: aiohttp.ClientResponse,
+    ) -> Tuple[int, Optional[int], Optional[int]]:
+        """(first byte, last byte, file size) of an upstream response, None when unknown."""
+        if response.status == 206:
+            # bytes 100-200/1000
+            try:
+                byte_range, _, size = response.headers.get("Content-Range", "")[6:].partition("/")
+                start, _, end = byte_range.partition("-")
+                return int(start), int(end), int(size) if size.isdigit() else None
+            except ValueError:
+                return 0, None, None
+        content_length = response.headers.get("Content-Length", "")
+        if content_length.isdigit():
+            return 0, int(content_length) - 1, int(content_length)
+        return 0, None, None
 
-        async with aiohttp.ClientSession(
-            timeout=timeout, connector=connector
-        ) as session:
-            async with session.get(url, headers=headers) as response:
-
-                async def fill_buffer():
-                    nonlocal current_buffer_size
-                    while True:
-                        try:
-                            if current_buffer_size < self.buffer_size:
-                                chunk = await response.content.read(self.chunk_size)
-                                if not chunk:
-                                    break
-                                buffer.append(chunk)
-                                current_buffer_size += len(chunk)
-                            else:
-                                await asyncio.sleep(0.1)
-                        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
-                            logger.error(f"Buffer filling error: {str(e)}")
-                            await asyncio.sleep(1)
-                            continue
-
-                buffer_task = asyncio.create_task(fill_buffer())
-
-                try:
-                    while not buffer:
-                        await asyncio.sleep(0.1)
-
-                    while True:
-                        if not buffer and current_buffer_size == 0:
-                            break
-
-                        if buffer:
-                            chunk = buffer.popleft()
-                            current_buffer_size -= len(chunk)
-                            yield chunk
-
-                        if current_buffer_size < buffer_low_threshold:
-                            await asyncio.sleep(0.1)
-
-                finally:
-                    buffer_task.cancel()
-                    try:
-                        await buffer_task
-                    except asyncio.CancelledError:
-                        pass
+    @staticmethod
+    def _resume_validator(response: aiohttp.ClientResponse) -> Optional[str]:
+        etag = response.headers.get("ETag")
+        # If-Range only accepts strong ETags
+        if etag and not etag.startswith("W/"):
+            return etag
+        return response.headers.get("Last-Modified")
@@ -1,34 +1,57 @@
 import base64
 import os
-from typing import Dict, Optional, List
+import struct
+import time
+from functools import lru_cache
+from typing import Dict, Optional, List, Tuple
 from urllib.parse import urlencode
 import asyncio
 
 import aiohttp
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from fastapi import HTTPException
 
-from utils.cache import cached_decorator
+from utils.cache import LocalCache, cached_decorator
 from utils.config import config
 from utils.logger import logger
+from utils.mediaflow import MediaFlowEncoder
+from utils.proxy_client import mediaflow_client
 from utils.season_cache import cache_season
 from services.base import StreamingService
 
+PROXY_TOKEN_VERSION = 1
+MEDIAFLOW_URL_EXPIRATION = 21600
+# Generated URLs are reused within a bucket, so they stay valid for at least 5 of their 6 hours
+MEDIAFLOW_CACHE_BUCKET = 3600
+MEDIAFLOW_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
 
 class URLProcessor:
     def __init__(self, encryption_key: bytes):
         self.fernet = Fernet(encryption_key)
+        self.aesgcm = AESGCM(
+            HKDF(
+                algorithm=hashes.SHA256(), length=32, salt=None, info=b"aiostremio proxy token"
+            ).derive(base64.urlsafe_b64decode(encryption_key))
+        )
+        # Players send many range requests with the same token, only the first one is decrypted
+        self._decrypt_token = lru_cache(maxsize=4096)(self._decrypt_token_uncached)
         self.addon_url = config.addon_url
         self.mediaflow_api_key = os.getenv("MEDIAFLOW_API_KEY")
+        self.mediaflow_encoder = MediaFlowEncoder(self.mediaflow_api_key)
         self.services = []
+        self._semaphore = asyncio.Semaphore(config.mediaflow_concurrency)
+        self._mediaflow_cache = LocalCache(8 * 1024 * 1024, MEDIAFLOW_URL_EXPIRATION)
+        self._batch_supported = True
 
     def set_services(self, services: List[StreamingService]):
         self.services = services
 
-    async def _generate_mediaflow_url(self, url: str) -> str:
-        """Generate an encrypted MediaFlow URL."""
-        params = {
-            "mediaflow_proxy_url": config.external_mediaflow_url,
+    def _mediaflow_params(self, url: str) -> Dict:
+        return {
             "endpoint": "/proxy/stream",
             "destination_url": url,
             "query_params": {},
@@ -37,13 +60,30 @@ class URLProcessor:
                 "origin": config.addon_url,
             },
             "response_headers": {},
-            "expiration": 21600,
+        }
+
+    def _encode_mediaflow_url(self, url: str) -> str:
+        """Build an encrypted MediaFlow URL without asking MediaFlow."""
+        return self.mediaflow_encoder.encode_url(
+            config.external_mediaflow_url,
+            expiration=MEDIAFLOW_URL_EXPIRATION,
+            **self._mediaflow_params(url),
+        )
+
+    async def _generate_mediaflow_url(self, url: str) -> str:
+        """Generate an encrypted MediaFlow URL."""
+        params = {
+            "mediaflow_proxy_url": config.external_mediaflow_url,
+            **self._mediaflow_params(url),
+            "expiration": MEDIAFLOW_URL_EXPIRATION,
             "api_password": self.mediaflow_api_key,
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{config.internal_mediaflow_url}/generate_encrypted_or_encoded_url", json=params
+        async with self._semaphore:
+            async with mediaflow_client.session.post(
+                f"{config.internal_mediaflow_url}/generate_encrypted_or_encoded_url",
+                json=params,
+                timeout=MEDIAFLOW_TIMEOUT,
             ) as response:
                 if response.status != 200:
                     raise HTTPException(
@@ -53,6 +93,85 @@ class URLProcessor:
                 logger.debug(f"Generated MediaFlow URL: {data['encoded_url']}")
                 return data["encoded_url"]
 
+    async def _generate_mediaflow_batch(self, urls: List[str]) -> Optional[List[str]]:
+        """Generate MediaFlow URLs in one request, None if the instance has no batch endpoint."""
+        params = {
+            "mediaflow_proxy_url": config.external_mediaflow_url,
+            "api_password": self.mediaflow_api_key,
+            "expiration": MEDIAFLOW_URL_EXPIRATION,
+            "urls": [self._mediaflow_params(url) for url in urls],
+        }
+        async with mediaflow_client.session.post(
+            f"{config.internal_mediaflow_url}/generate_urls",
+            json=params,
+            timeout=MEDIAFLOW_TIMEOUT,
+        ) as response:
+            if response.status in (404, 405, 422):
+                logger.info("MediaFlow has no batch URL endpoint, generating URLs one by one")
+                self._batch_supported = False
+                return None
+            if response.status != 200:
+                raise HTTPException(
+                    status_code=500, detail="Failed to generate MediaFlow URLs"
+                )
+            data = await response.json()
+
+        generated = data.get("urls") or []
+        if len(generated) != len(urls):
+            raise HTTPException(
+                status_code=500, detail="MediaFlow returned the wrong number of URLs"
+            )
+        return generated
+
+    async def _generate_mediaflow_urls(self, urls: List[str]) -> Dict[str, str]:
+        """Return MediaFlow URLs for the given URLs, leaving out the ones that failed.
+
+        URLs are encoded locally unless that is disabled. MediaFlow generated URLs
+        are reused until the end of their expiry bucket, which leaves them valid for
+        most of MEDIAFLOW_URL_EXPIRATION. Missing ones are generated with a single
+        batch request when MediaFlow supports it, otherwise concurrently.
+        """
+        if config.mediaflow_local_urls:
+            try:
+                return {url: self._encode_mediaflow_url(url) for url in urls}
+            except Exception as e:
+                logger.error(f"Failed to encode MediaFlow URLs locally, using MediaFlow: {str(e)}")
+
+        now = time.time()
+        bucket = int(now // MEDIAFLOW_CACHE_BUCKET)
+        bucket_ttl = max(1, int((bucket + 1) * MEDIAFLOW_CACHE_BUCKET - now))
+
+        results = {}
+        missing = []
+        for url in dict.fromkeys(urls):
+            cached = self._mediaflow_cache.get(f"{bucket}:{url}")
+            if cached is not None:
+                results[url] = cached
+            else:
+                missing.append(url)
+        if not missing:
+            return results
+
+        generated = None
+        if self._batch_supported and len(missing) > 1:
+            try:
+                generated = await self._generate_mediaflow_batch(missing)
+            except Exception as e:
+                logger.error(f"Failed to generate MediaFlow URLs in a batch: {str(e)}")
+        if generated is None:
+            generated = await asyncio.gather(
+                *(self._generate_mediaflow_url(url) for url in missing),
+                return_exceptions=True,
+            )
+
+        for url, mediaflow_url in zip(missing, generated):
+            if isinstance(mediaflow_url, BaseException):
+                logger.error(f"Failed to generate MediaFlow URL: {str(mediaflow_url)}")
+                continue
+            results[url] = mediaflow_url
+            self._mediaflow_cache.set(f"{bucket}:{url}", mediaflow_url, len(url) + len(mediaflow_url), bucket_ttl)
+        return results
+
     async def process_stream_urls(
         self, streams: Dict[str, list], user_path: str, proxy_enabled: bool, meta_id: str = None
     ) -> None:
@@ -62,42 +181,61 @@ class URLProcessor:
             logger.info(f"Triggering background caching for season of {meta_id}")
             asyncio.create_task(cache_season(meta_id, self.services))
 
-        for stream in streams:
-            if "url" in stream and proxy_enabled:
-                if config.mediaflow_enabled and config.external_mediaflow_url:
-                    # Use MediaFlow URL encryption
-                    try:
-                        mediaflow_url = await self._generate_mediaflow_url(
-                            stream["url"]
-                        )
-                        stream["url"] = mediaflow_url
-                    except Exception as e:
-                        logger.error(f"Failed to generate MediaFlow URL: {str(e)}")
-                        streams.remove(stream)
+        if not proxy_enabled:
+            return
+
+        if config.mediaflow_enabled and config.external_mediaflow_url:
+            # Use MediaFlow URL encryption, streams whose URL couldn't be generated are dropped
+            mediaflow_urls = await self._generate_mediaflow_urls(
+                [stream["url"] for stream in streams if "url" in stream]
+            )
+            kept_streams = []
+            for stream in streams:
+                if "url" in stream:
+                    if stream["url"] not in mediaflow_urls:
                         continue
-                else:
-                    encrypted_url = self.fernet.encrypt(stream["url"].encode()).decode()
-                    safe_encrypted_url = base64.urlsafe_b64encode(
-                        encrypted_url.encode()
-                    ).decode()
-                    proxy_url = (
-                        f"{self.addon_url}/{user_path}/proxy/{safe_encrypted_url}"
-                    )
-                    logger.debug(f"Generated proxy URL: {proxy_url}")
-                    stream["url"] = proxy_url
+                    stream["url"] = mediaflow_urls[stream["url"]]
+                kept_streams.append(stream)
+            streams[:] = kept_streams
+            return
 
-    def decrypt_url(self, encrypted_url: str) -> str:
-        """Decrypt an encrypted URL."""
-        try:
-            # Add padding if needed
-            padding_needed = len(encrypted_url) % 4
-            if padding_needed:
-                encrypted_url += "=" * (4 - padding_needed)
+        for stream in streams:
+            if "url" in stream:
+                proxy_url = (
+                    f"{self.addon_url}/{user_path}/proxy/{self.encrypt_url(stream['url'], user_path)}"
+                )
+                logger.debug(f"Generated proxy URL: {proxy_url}")
+                stream["url"] = proxy_url
+
+    def encrypt_url(self, url: str, user_path: str) -> str:
+        """Encrypt a URL into a proxy token bound to user_path.
 
-            decoded_url = base64.urlsafe_b64decode(encrypted_url.encode()).decode()
-            original_url = self.fernet.decrypt(decoded_url.encode()).decode()
-            return original_url
+        Token layout before base64: version byte, 12 byte nonce, then the AES-GCM
+        encrypted expiry (4 bytes, 0 for none) and URL, authenticated with user_path.
+        """
+        ttl = config.proxy_link_ttl_hours * 3600
+        expires = int(time.time()) + ttl if ttl else 0
+        nonce = os.urandom(12)
+        payload = struct.pack(">I", expires) + url.encode()
+        token = bytes([PROXY_TOKEN_VERSION]) + nonce + self.aesgcm.encrypt(nonce, payload, user_path.encode())
+        return base64.urlsafe_b64encode(token).rstrip(b"=").decode()
 
+    def decrypt_url(self, encrypted_url: str, user_path: str) -> str:
+        """Decrypt an encrypted URL."""
+        try:
+            original_url, expires = self._decrypt_token(encrypted_url, user_path)
         except Exception as e:
             logger.error(f"URL processing error: {str(e)}")
             raise HTTPException(status_code=400, detail="Invalid URL format")
+
+        if expires and expires < time.time():
+            raise HTTPException(status_code=410, detail="Proxy link expired")
+        return original_url
+
+    def _decrypt_token_uncached(self, token: str, user_path: str) -> Tuple[str, int]:
+        """Return the URL and expiry of a token, legacy tokens are base64 encoded Fernet tokens."""
+        data = base64.urlsafe_b64decode((token + "=" * (-len(token) % 4)).encode())
+        if data[0] == PROXY_TOKEN_VERSION:
+            payload = self.aesgcm.decrypt(data[1:13], data[13:], user_path.encode())
+            return payload[4:].decode(), struct.unpack(">I", payload[:4])[0]
+        return self.fernet.decrypt(data).decode(), 0
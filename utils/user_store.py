@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from utils.logger import logger
+
+
+class UserStore:
+    """In-memory view of db/users.json.
+
+    The file is parsed once and re-read only when its inode, mtime or size changes
+    (checked at most every check_interval seconds). Writes go through a lock and
+    replace the file atomically, so readers never see a half-written file.
+
+    Dicts returned by get() are shared with the store and must not be mutated,
+    use update() instead.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+
+        with self._lock:
+            if signature is None:
+                self._users = {}
+            else:
+                try:
+                    with open(self.path, "r") as f:
+                        self._users = json.load(f)
+                except (OSError, ValueError) as e:
+                    # Keep serving the last good copy if the file is mid-edit or broken
+                    logger.error(f"Error loading users file: {str(e)}")
+                    return
+            self._signature = signature
+            logger.debug(f"Loaded {len(self._users)} users from {self.path}")
+
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        self._refresh()
+        return self._users.get(username)
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        """Return a copy of all users that callers may modify."""
+        self._refresh()
+        return {username: dict(data) for username, data in self._users.items()}
+
+    def add(self, username: str, data: Dict[str, Any]) -> bool:
+        """Add a user, returns False if the username is taken."""
+        with self._lock:
+            self._refresh_now()
+            if username in self._users:
+                return False
+            users = dict(self._users)
+            users[username] = data
+            self._write(users)
+            return True
+
+    def update(self, username: str, **changes: Any) -> Optional[Dict[str, Any]]:
+        """Apply changes to a user, returns the updated user or None if it does not exist."""
+        with self._lock:
+            self._refresh_now()
+            if username not in self._users:
+                return None
+            users = dict(self._users)
+            users[username] = {**users[username], **changes}
+            self._write(users)
+            return users[username]
+
+    def delete(self, username: str) -> bool:
+        with self._lock:
+            self._refresh_now()
+            if username not in self._users:
+                return False
+            users = dict(self._users)
+            del users[username]
+            self._write(users)
+            return True
+
+    def _refresh_now(self) -> None:
+        self._checked_at = 0.0
+        self._refresh()
+
+    def _write(self, users: Dict[str, Dict[str, Any]]) -> None:
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".users.", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(users, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            mode = os.stat(self.path).st_mode & 0o777 if os.path.exists(self.path) else 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._users = users
+        self._signature = self._file_signature()
+        self._checked_at = time.monotonic()
+
+
+user_store = UserStore(
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "db/users.json")
+)